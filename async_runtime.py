@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from telegram import Update
+from tornado.httpclient import AsyncHTTPClient
+
+import corona
+import metrics
+from update_scheduler import UpdateScheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMAND_WORKERS = 8
+_LONG_POLL_TIMEOUT = 30
+_RETRY_DELAY = 5
+_LATENCY_SAMPLES = 1000
+
+
+class AsyncRuntime():
+    """Runs the bot on an asyncio event loop.
+
+    Updates are long-polled from the Bot API without blocking the loop and each one is handled by the dispatcher on
+    a pool of command workers. The corona update check runs on the loop as well, the (blocking) refresh and the
+    following broadcast use their own ingest thread. So commands are answered at the same latency while an update
+    is running.
+    """
+
+    def __init__(self, bot, dispatcher, corona_update_interval, command_workers=DEFAULT_COMMAND_WORKERS):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.corona_update_interval = corona_update_interval
+        self.command_executor = ThreadPoolExecutor(command_workers, thread_name_prefix="command")
+        self.ingest_executor = ThreadPoolExecutor(1, thread_name_prefix="ingest")
+
+        self.in_flight = 0
+        self.handled = 0
+        self.latencies = deque(maxlen=_LATENCY_SAMPLES)
+        self._offset = None
+        self._tasks = set()
+
+    def run(self):
+        asyncio.get_event_loop().run_until_complete(self.run_async())
+
+    async def run_async(self):
+        if self.corona_update_interval is None:
+            # Another process updates the data
+            await self.poll_updates()
+        else:
+            await asyncio.gather(self.poll_updates(), self.schedule_updates())
+
+    async def poll_updates(self):
+        while True:
+            try:
+                updates = await self._get_updates()
+            except Exception as e:
+                logger.warning("Fetching updates failed: {}".format(e))
+                await asyncio.sleep(_RETRY_DELAY)
+                continue
+
+            for data in updates:
+                self._offset = data["update_id"] + 1
+                self.handle(Update.de_json(data, self.bot))
+
+    async def _get_updates(self):
+        params = {"timeout": _LONG_POLL_TIMEOUT}
+        if self._offset is not None:
+            params["offset"] = self._offset
+
+        response = await AsyncHTTPClient().fetch("{}/getUpdates?{}".format(self.bot.base_url, urlencode(params)),
+                                                 request_timeout=_LONG_POLL_TIMEOUT + 10)
+        body = json.loads(response.body)
+        if not body.get("ok"):
+            raise RuntimeError(body.get("description"))
+        return body["result"]
+
+    def handle(self, update):
+        task = asyncio.ensure_future(self._handle(update))
+        # Keep a reference until the task is done, the loop only holds weak references
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _handle(self, update):
+        started = time.monotonic()
+        self.in_flight += 1
+        try:
+            await asyncio.get_event_loop().run_in_executor(self.command_executor, self.dispatcher.process_update,
+                                                           update)
+        except Exception:
+            logger.exception("Handling update {} failed.".format(update.update_id))
+        finally:
+            self.in_flight -= 1
+            self.handled += 1
+            self.latencies.append(time.monotonic() - started)
+
+    async def schedule_updates(self):
+        scheduler = UpdateScheduler(self.corona_update_interval)
+        while True:
+            await asyncio.sleep(scheduler.delay())
+            updated = await self.check_update()
+            scheduler.checked(updated or 0, failed=updated is None)
+
+    async def check_update(self):
+        try:
+            return await corona.check_update_async(self.ingest_executor)
+        except Exception:
+            logger.exception("Corona update failed.")
+            return None
+
+    def stats(self):
+        return {
+            "handled": self.handled,
+            "in_flight": self.in_flight,
+            **metrics.latency_percentiles(self.latencies),
+        }
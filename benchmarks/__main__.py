@@ -0,0 +1,4 @@
+# The scenarios run in spawned processes, which can't import functions of a __main__ module
+from benchmarks.suite import main
+
+main()
@@ -0,0 +1,34 @@
+"""Measures the throughput of broadcast.Broadcaster against a fake bot.
+
+Run: python -m benchmarks.broadcast --users 10000 --rate 30
+"""
+from argparse import ArgumentParser
+
+from benchmarks.fake_telegram import FakeBot
+from broadcast import Broadcaster
+
+
+def run(users, rate, workers, latency, timeout_rate, blocked_rate):
+    bot = FakeBot(latency=latency, timeout_rate=timeout_rate, blocked_rate=blocked_rate, flood_limit=rate)
+    broadcaster = Broadcaster(bot, workers=workers, rate=rate, retry_backoff=0.1, progress_interval=5.0,
+                              progress_callback=lambda progress: print("  {}".format(progress)))
+
+    progress = broadcaster.broadcast((chat_id, "Message {}".format(chat_id)) for chat_id in range(users))
+
+    print("users: {}, workers: {}, rate limit: {}/s, latency: {:.0f} ms".format(users, workers, rate, latency * 1000))
+    print("sent: {}, failed: {}, retries: {}, flood errors: {}".format(
+        progress.sent, progress.failed, progress.retries, bot.flood_errors))
+    print("elapsed: {:.1f} s, throughput: {:.1f} messages/s".format(progress.elapsed, progress.throughput))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per API call.")
+    parser.add_argument("--timeout_rate", type=float, default=0.01)
+    parser.add_argument("--blocked_rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    run(args.users, args.rate, args.workers, args.latency, args.timeout_rate, args.blocked_rate)
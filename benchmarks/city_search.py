@@ -0,0 +1,70 @@
+"""Compares the n-gram index of city_search with the former first-letter bucket scan.
+
+Run: python -m benchmarks.city_search
+"""
+import json
+import random
+import timeit
+from difflib import SequenceMatcher
+
+from benchmarks.synthetic import districts, typo
+from city_search import CitySearchIndex
+
+
+class FirstLetterBucketSearch():
+    # The former corona.find_city, with the redis sets and strings replaced by dicts
+
+    def __init__(self, datas):
+        self.buckets = {}
+        self.records = {}
+        for data in datas:
+            self.buckets.setdefault(data["GEN"][0].upper(), set()).add(data["OBJECTID"])
+            self.records[data["OBJECTID"]] = json.dumps(data)
+
+    def search(self, name):
+        name_upper = name.upper()
+
+        matching_cities = []
+        for object_id in self.buckets.get(name_upper[0], ()):
+            corona_data = json.loads(self.records[object_id])
+            city_upper = corona_data["GEN"].upper()
+            if name_upper in city_upper or SequenceMatcher(None, name_upper, city_upper).ratio() >= 0.8:
+                matching_cities.append(object_id)
+        return matching_cities
+
+
+def _queries(datas, rnd):
+    names = [data["GEN"] for data in datas]
+    return {
+        "exact": [(name, name) for name in names],
+        "prefix": [(name[:4], name) for name in names],
+        "typo (first letter)": [(typo(name, rnd, 0), name) for name in names],
+        "typo (anywhere)": [(typo(name, rnd), name) for name in names],
+    }
+
+
+def run():
+    rnd = random.Random(1)
+    datas = districts()
+    ids_by_name = {data["GEN"]: data["OBJECTID"] for data in datas}
+
+    buckets = FirstLetterBucketSearch(datas)
+    index = CitySearchIndex()
+    for data in datas:
+        index.update(data["OBJECTID"], data["GEN"])
+
+    print("{} districts".format(len(datas)))
+    print("{:<22}{:>18}{:>18}{:>12}{:>12}".format("queries", "buckets [us/q]", "n-grams [us/q]", "recall b.", "recall n."))
+    for kind, queries in _queries(datas, rnd).items():
+        timings = []
+        recalls = []
+        for implementation in (buckets, index):
+            timings.append(timeit.timeit(lambda: [implementation.search(query) for query, _ in queries], number=3)
+                           / (3 * len(queries)) * 1e6)
+            recalls.append(sum(1 for query, name in queries if ids_by_name[name] in implementation.search(query))
+                           / len(queries))
+        print("{:<22}{:>18.1f}{:>18.1f}{:>12.2f}{:>12.2f}".format(kind, timings[0], timings[1], *recalls))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,99 @@
+"""Load test: latency of commands sent by many users at once, handled by the threaded Updater and AsyncRuntime.
+
+The handler simulates blocking storage access. Both runtimes run the handlers on --workers threads. Both runtimes talk to a local fake Bot API.
+Run: python -m benchmarks.commands --users 200 --storage_latency 0.02
+"""
+import asyncio
+import threading
+import time
+from argparse import ArgumentParser
+
+from telegram.ext import CommandHandler, Updater
+
+from async_runtime import AsyncRuntime
+from benchmarks.fake_telegram import FakeTelegramAPI
+
+_TOKEN = "123:benchmark"
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))] if values else float("nan")
+
+
+def _updater(api, storage_latency, workers, run_async=False):
+    def _info(update, context):
+        time.sleep(storage_latency)
+        update.message.reply_text("Info for {}".format(update.message.chat_id))
+
+    updater = Updater(_TOKEN, base_url=api.base_url, workers=workers, use_context=True)
+    # The bot's handlers run on the dispatcher thread, the Updater's workers only run handlers marked run_async
+    updater.dispatcher.add_handler(CommandHandler("info", _info, run_async=run_async))
+    return updater
+
+
+def _send_commands(api, users):
+    for chat_id in range(1, users + 1):
+        api.send_command(chat_id, "/info")
+
+
+def run_threaded(users, storage_latency, workers, run_async=False):
+    api = FakeTelegramAPI().start()
+    updater = _updater(api, storage_latency, workers, run_async)
+    updater.start_polling(poll_interval=0.0, timeout=1)
+
+    started = time.monotonic()
+    _send_commands(api, users)
+    api.wait_for_replies(users)
+    elapsed = time.monotonic() - started
+
+    updater.stop()
+    api.stop()
+    return elapsed, api.latencies
+
+
+def run_async(users, storage_latency, workers):
+    api = FakeTelegramAPI().start()
+    updater = _updater(api, storage_latency, workers)
+    runtime = AsyncRuntime(updater.bot, updater.dispatcher, corona_update_interval=None, command_workers=workers)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    poller = loop.create_task(runtime.poll_updates())
+
+    started = time.monotonic()
+    threading.Thread(target=_send_commands, args=(api, users)).start()
+
+    async def _wait():
+        while len(api.replies) < users:
+            await asyncio.sleep(0.01)
+
+    loop.run_until_complete(_wait())
+    elapsed = time.monotonic() - started
+
+    poller.cancel()
+    api.stop()
+    return elapsed, api.latencies
+
+
+def run(users, storage_latency, workers):
+    print("{} users sending /info at once, {:.0f} ms storage latency per command, {} workers".format(
+        users, storage_latency * 1000, workers))
+    print("{:<22}{:>12}{:>12}{:>12}{:>16}".format("runtime", "total [s]", "p50 [ms]", "p99 [ms]", "commands/s"))
+    for name, result in (("threaded (Updater)", run_threaded(users, storage_latency, workers)),
+                         ("threaded (run_async)", run_threaded(users, storage_latency, workers, run_async=True)),
+                         ("asyncio", run_async(users, storage_latency, workers))):
+        elapsed, latencies = result
+        print("{:<22}{:>12.2f}{:>12.1f}{:>12.1f}{:>16.1f}".format(
+            name, elapsed, _percentile(latencies, 0.5) * 1000, _percentile(latencies, 0.99) * 1000,
+            users / elapsed))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--storage_latency", type=float, default=0.02, help="Seconds of blocking I/O per command.")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    run(args.users, args.storage_latency, args.workers)
@@ -0,0 +1,70 @@
+"""Compares answering the statistics commands from the CountyTable with computing them from the stored records.
+
+Reports the time to build the table (once per refresh) and per query, and the time the same query takes over the
+records of corona.get_datas, as /top would have been written without the table.
+Run: python -m benchmarks.county_stats --backend redislite
+"""
+import shutil
+import tempfile
+import timeit
+from argparse import ArgumentParser
+
+from benchmarks.fake_rki import FakeRKI
+
+
+def _records_top(corona, count):
+    datas = corona.get_datas(list(corona._redis_corona.scan_keys()))
+    return sorted(datas, key=lambda data: data[corona.C_CASES7_PER_100K], reverse=True)[:count]
+
+
+def _records_state(corona, state):
+    datas = [data for data in corona.get_datas(list(corona._redis_corona.scan_keys())) if data[corona.C_STATE] == state]
+    values = sorted(data[corona.C_CASES7_PER_100K] for data in datas)
+    return len(values), values[len(values) // 2], sum(data[corona.C_CASES] for data in datas)
+
+
+def _records_above(corona, threshold):
+    return [data for data in corona.get_datas(list(corona._redis_corona.scan_keys()))
+            if data[corona.C_CASES7_PER_100K] > threshold]
+
+
+def _best(statement, number):
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number
+
+
+def run(backend):
+    directory = tempfile.mkdtemp()
+    rki = FakeRKI().start()
+    try:
+        import config
+        config._config = {"telegramToken": "123:stats", "databaseDirectory": directory, "storageBackend": backend,
+                          "coronaApiUrl": rki.url}
+
+        import corona
+        from county_stats import CountyTable
+
+        corona.check_update()
+        table = corona.county_table()
+        state = table.state_names[0]
+        rows = [(data[corona.C_OBJECT_ID], data[corona.C_CITY_AREA], data[corona.C_CITY_AREA_DESCRIPTION],
+                 data[corona.C_STATE], data[corona.C_CASES7_PER_100K], data[corona.C_CASES],
+                 data[corona.C_CASES7_BL_PER_100K]) for data in rki.districts]
+
+        print("build table ({} rows): {:>9.1f} us".format(len(table), _best(lambda: CountyTable(rows), 20) * 1e6))
+        for name, from_table, from_records in (
+                ("top 10", lambda: corona.county_table().top(10), lambda: _records_top(corona, 10)),
+                ("state", lambda: corona.county_table().state(state), lambda: _records_state(corona, state)),
+                ("above 200", lambda: corona.county_table().above(200, 50), lambda: _records_above(corona, 200))):
+            print("{:<10} table {:>9.1f} us, records {:>9.1f} us".format(
+                name, _best(from_table, 2000) * 1e6, _best(from_records, 20) * 1e6))
+    finally:
+        rki.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--backend", default="redislite")
+    args = parser.parse_args()
+
+    run(args.backend)
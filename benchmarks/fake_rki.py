@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic import districts
+
+_OBJECT_IDS = re.compile(r"OBJECTID\s+IN\s*\(([\d,\s]*)\)", re.IGNORECASE)
+
+
+class FakeRKI():
+    """A local HTTP server answering ArcGIS feature queries (where, outFields) like the RKI service.
+
+    Supports ETag/If-None-Match and gzip. publish() simulates RKI publishing new data.
+    """
+
+    def __init__(self, count=None, port=0):
+        self.districts = districts() if count is None else districts(count)
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._answer(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}/query".format(self._httpd.server_address[1])
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def publish(self, last_update, object_ids=None):
+        with self._lock:
+            for data in self.districts:
+                if object_ids is None or data["OBJECTID"] in object_ids:
+                    data["last_update"] = last_update
+                    data["cases"] += 10
+                    data["cases7_per_100k"] *= 1.05
+
+    def _query(self, where, out_fields):
+        match = _OBJECT_IDS.search(where)
+        object_ids = None if match is None else set(int(i) for i in match.group(1).split(",") if i.strip())
+        fields = None if out_fields in ("*", "") else out_fields.split(",")
+
+        with self._lock:
+            features = [{"attributes": {key: value for key, value in data.items() if fields is None or key in fields}}
+                        for data in self.districts if object_ids is None or data["OBJECTID"] in object_ids]
+        return {"objectIdFieldName": "OBJECTID", "geometryType": "esriGeometryPolygon",
+                "fields": [{"name": field} for field in (fields or [])], "features": features}
+
+    def _answer(self, handler):
+        query = parse_qs(urlparse(handler.path).query)
+        body = json.dumps(self._query(query.get("where", ["1=1"])[0], query.get("outFields", ["*"])[0])).encode()
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+
+        with self._lock:
+            self.requests += 1
+        if handler.headers.get("If-None-Match") == etag:
+            with self._lock:
+                self.not_modified += 1
+            handler.send_response(304)
+            handler.send_header("ETag", etag)
+            handler.end_headers()
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("ETag", etag)
+        if "gzip" in handler.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            handler.send_header("Content-Encoding", "gzip")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+        with self._lock:
+            self.bytes_sent += len(body)
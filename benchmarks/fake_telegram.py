@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+
+from telegram.error import RetryAfter, TimedOut, Unauthorized
+
+
+class FakeBot():
+    """Stands in for telegram.Bot. Every call takes latency seconds, some calls fail like the real API does."""
+
+    username = "benchmark_bot"
+    defaults = None
+
+    def __init__(self, latency=0.05, timeout_rate=0.0, blocked_rate=0.0, flood_limit=None, seed=0):
+        self.latency = latency
+        self.timeout_rate = timeout_rate
+        self.blocked_rate = blocked_rate
+        # More than flood_limit messages within one second are answered with RetryAfter
+        self.flood_limit = flood_limit
+        self.messages = []
+        self.flood_errors = 0
+        self._random = random.Random(seed)
+        self._window = (0, 0)
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        time.sleep(self.latency)
+        with self._lock:
+            if self.flood_limit is not None:
+                second = int(time.monotonic())
+                count = self._window[1] + 1 if self._window[0] == second else 1
+                self._window = (second, count)
+                if count > self.flood_limit:
+                    self.flood_errors += 1
+                    raise RetryAfter(1)
+
+            chance = self._random.random()
+            if chance < self.blocked_rate:
+                raise Unauthorized("Forbidden: bot was blocked by the user")
+            if chance < self.blocked_rate + self.timeout_rate:
+                raise TimedOut()
+
+            self.messages.append((chat_id, text, parse_mode))
+
+
+class FakeTelegramAPI():
+    """A local HTTP server speaking the part of the Bot API the bot uses: getUpdates and sendMessage.
+
+    Updates are injected with send_command(). For every reply, the time since the command was injected is recorded.
+    """
+
+    def __init__(self, port=0):
+        self.port = port
+        self.updates = []
+        self.replies = []
+        self.latencies = []
+        self._sent_at = {}
+        self._next_update_id = 1
+        self._lock = threading.Lock()
+        self._loop = None
+
+    @property
+    def base_url(self):
+        return "http://127.0.0.1:{}/bot".format(self.port)
+
+    def start(self):
+        started = threading.Event()
+        threading.Thread(target=self._serve, args=(started,), daemon=True).start()
+        started.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.add_callback(self._loop.stop)
+
+    def _serve(self, started):
+        import asyncio
+
+        from tornado.httpserver import HTTPServer
+        from tornado.ioloop import IOLoop
+        from tornado.netutil import bind_sockets
+        from tornado.web import Application, RequestHandler
+
+        api = self
+
+        class MethodHandler(RequestHandler):
+            def get(self, token, method):
+                self._answer(method, {key: self.get_argument(key) for key in self.request.arguments})
+
+            def post(self, token, method):
+                import json
+                if self.request.headers.get("Content-Type", "").startswith("application/json"):
+                    arguments = json.loads(self.request.body or b"{}")
+                else:
+                    arguments = {key: self.get_argument(key) for key in self.request.arguments}
+                self._answer(method, arguments)
+
+            def _answer(self, method, arguments):
+                if method == "getUpdates":
+                    result = api._get_updates(int(arguments.get("offset") or 0))
+                elif method == "sendMessage":
+                    result = api._send_message(int(arguments["chat_id"]), arguments.get("text"))
+                elif method == "getMe":
+                    result = {"id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"}
+                elif method == "getMyCommands":
+                    result = []
+                else:
+                    result = True
+                self.write({"ok": True, "result": result})
+
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        sockets = bind_sockets(self.port, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        application = Application([(r"/bot([^/]+)/(\w+)", MethodHandler)])
+        HTTPServer(application).add_sockets(sockets)
+
+        self._loop = IOLoop.current()
+        started.set()
+        self._loop.start()
+
+    def send_command(self, chat_id, command):
+        with self._lock:
+            update_id = self._next_update_id
+            self._next_update_id += 1
+            self._sent_at[chat_id] = time.monotonic()
+            self.updates.append(self.update_json(update_id, chat_id, command))
+
+    @staticmethod
+    def update_json(update_id, chat_id, text):
+        command_length = len(text.split(" ")[0])
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "User {}".format(chat_id)},
+                "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": command_length}],
+            },
+        }
+
+    def _get_updates(self, offset):
+        with self._lock:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+            return list(self.updates[:100])
+
+    def _send_message(self, chat_id, text):
+        with self._lock:
+            sent_at = self._sent_at.pop(chat_id, None)
+            if sent_at is not None:
+                self.latencies.append(time.monotonic() - sent_at)
+            self.replies.append((chat_id, text))
+            return {"message_id": len(self.replies), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    def wait_for_replies(self, count, timeout=300):
+        deadline = time.monotonic() + timeout
+        while len(self.replies) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return len(self.replies) >= count
@@ -0,0 +1,114 @@
+"""Kills the bot in the middle of a broadcast and restarts it, like a crash during notify_users.
+
+Reports how many messages were lost or delivered twice and what the restart cost. Every run is a fresh interpreter
+on the same sqlite database.
+Run: python -m benchmarks.outbox --users 2000 --crash-after 700
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import Counter
+
+from benchmarks.fake_rki import FakeRKI
+from benchmarks.fake_telegram import FakeBot
+
+
+class _RecordingBot(FakeBot):
+    # Appends every delivered message to a file, the process can die at any time. Dies after crash_after messages.
+
+    def __init__(self, filename, crash_after=None):
+        super().__init__(latency=0.0)
+        self.crash_after = crash_after
+        self._file = open(filename, "a", buffering=1)
+
+    def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        with self._lock:
+            if self.crash_after is not None and len(self.messages) >= self.crash_after:
+                os._exit(1)
+            self._file.write("{}\n".format(chat_id))
+            self.messages.append((chat_id, text, parse_mode))
+
+
+def _setup(directory, rki_url):
+    import config
+    config._config = {"telegramToken": "123:outbox", "databaseDirectory": directory, "storageBackend": "sqlite",
+                      "broadcastMessagesPerSecond": 100000, "broadcastWorkers": 8}
+
+    import corona
+    corona.CORONA_API_URL = rki_url
+    return corona
+
+
+def _prepare(directory, rki_url, users):
+    corona = _setup(directory, rki_url)
+    import user
+
+    corona.check_update()
+    object_ids = sorted(int(object_id) for object_id in corona._redis_corona.scan_keys())
+    for user_id in range(1, users + 1):
+        user.add_city(object_ids[user_id % len(object_ids)], user_id)
+
+
+def _run(directory, rki_url, sent_file, crash_after, resume, results):
+    corona = _setup(directory, rki_url)
+    import notification
+    import telegram_bot
+    from types import SimpleNamespace
+
+    telegram_bot._updater = SimpleNamespace(bot=_RecordingBot(sent_file, crash_after))
+    corona._update_callback = notification.notify_users
+
+    rendered = []
+    full_info = corona.full_info
+    corona.full_info = lambda data: rendered.append(1) or full_info(data)
+
+    started = time.perf_counter()
+    if resume:
+        notification.resume()
+    else:
+        corona.check_update()
+    results.put((time.perf_counter() - started, len(rendered)))
+
+
+def run(users, crash_after):
+    directory = tempfile.mkdtemp()
+    sent_file = os.path.join(directory, "sent.txt")
+    rki = FakeRKI().start()
+    context = multiprocessing.get_context("spawn")
+    try:
+        process = context.Process(target=_prepare, args=(directory, rki.url, users))
+        process.start()
+        process.join()
+
+        rki.publish("02.11.2020, 00:00 Uhr")
+        for name, resume in (("update", False), ("restart", True)):
+            results = context.Queue()
+            process = context.Process(target=_run, args=(directory, rki.url, sent_file,
+                                                         None if resume else crash_after, resume, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print("{:<10} crashed".format(name))
+                continue
+            elapsed, rendered = results.get()
+            print("{:<10} {:>8.1f} ms, {} messages rendered".format(name, elapsed * 1000, rendered))
+
+        with open(sent_file) as f:
+            deliveries = Counter(int(line) for line in f)
+        print("users: {}, delivered: {}, lost: {}, delivered twice: {}".format(
+            users, len(deliveries), users - len(deliveries), sum(1 for count in deliveries.values() if count > 1)))
+    finally:
+        rki.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--crash-after", type=int, default=700)
+    args = parser.parse_args()
+
+    run(args.users, args.crash_after)
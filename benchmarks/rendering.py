@@ -0,0 +1,122 @@
+"""Compares rendering /info and notification messages from precomputed fragments with the former formatting.
+
+Run: python -m benchmarks.rendering
+"""
+import random
+import shutil
+import tempfile
+import timeit
+
+import config
+from benchmarks.fake_rki import FakeRKI
+from cache import VersionedCache
+
+
+class FormerRenderer():
+    # The former corona.full_info, formatting everything but the memoized city info on every call
+
+    def __init__(self, corona):
+        self.corona = corona
+        self.city_info_cache = VersionedCache()
+        self.city_info_cache.invalidate(corona.dataset_version())
+
+    def full_info(self, data):
+        corona = self.corona
+        sorted_data = sorted(data, key=lambda x: x[corona.C_CITY_AREA])
+        states_info = self.full_states_info(sorted_data)
+        cities_info = "\n\n".join([self.full_city_info(d) for d in sorted_data])
+        cities_info = "<u>Cities/Areas</u>:\n" + cities_info
+        landscape_quick_info = self.city_landscape_quick_info(sorted_data)
+        return "{}\n\n{}\n\n{}".format(states_info, cities_info, landscape_quick_info)
+
+    def city_landscape_quick_info(self, datas):
+        corona = self.corona
+        cities_and_cases7 = [("{} ({})".format(data[corona.C_CITY_AREA], data[corona.C_CITY_AREA_DESCRIPTION]),
+                              "{:.2f}".format(data[corona.C_CASES7_PER_100K])) for data in datas]
+        longest_city_name = max([len(city_cases7[0]) for city_cases7 in cities_and_cases7])
+        longest_cases7 = max([len(city_cases7[1]) for city_cases7 in cities_and_cases7])
+
+        info = "_" * (longest_city_name + longest_cases7 + 5)
+        info += "\n"
+        for city, cases7 in cities_and_cases7:
+            city = self._fill_whitespace(city, longest_city_name)
+            cases7 = self._fill_whitespace(cases7, longest_cases7, left=True)
+            info += "|{} | {}|".format(city, cases7)
+            info += "\n"
+        info += "-" * (longest_city_name + longest_cases7 + 5)
+        return "<u>Quick overview</u> (use landscape mode):\n<pre>{}</pre>".format(info)
+
+    @staticmethod
+    def _fill_whitespace(value, length, left=False):
+        if len(value) < length:
+            if left:
+                return (" " * (length - len(value))) + value
+            return value + " " * (length - len(value))
+        elif len(value) > length:
+            raise ValueError("{} has more than {} characters.".format(value, length))
+        return value
+
+    def full_city_info(self, data):
+        corona = self.corona
+        key = (data[corona.C_OBJECT_ID], data[corona.C_LAST_UPDATE])
+        info = self.city_info_cache.get(key)
+        if info is None:
+            info = corona._render_fragments([data])[0].city_info
+            self.city_info_cache.put(key, info, self.city_info_cache.version)
+        return info
+
+    def full_states_info(self, datas):
+        corona = self.corona
+        # Sorted instead of a set, so the output can be compared
+        states = sorted(set([(d[corona.C_STATE], d[corona.C_CASES7_BL_PER_100K]) for d in datas]))
+        info = "<u>States</u> - cases last 7 days per 100k:"
+        info += "\n"
+        info += "\n\t".join(["{}: {:.2f}".format(*state) for state in states])
+        return info
+
+
+def _normalized(info):
+    # The order of the states differs, the former implementation used a set
+    states, rest = info.split("\n\n", 1)
+    header, lines = states.split("\n", 1)
+    return "{}\n{}\n\n{}".format(header, "\n\t".join(sorted(lines.split("\n\t"))), rest)
+
+
+def run(number):
+    directory = tempfile.mkdtemp()
+    config._config = {"telegramToken": "123:rendering", "databaseDirectory": directory, "storageBackend": "memory"}
+    rki = FakeRKI().start()
+    try:
+        import corona
+        corona.CORONA_API_URL = rki.url
+
+        # Two updates, so every county has a trend
+        corona.check_update()
+        rki.publish("02.11.2020, 00:00 Uhr")
+        corona.check_update()
+
+        former = FormerRenderer(corona)
+        object_ids = [data["OBJECTID"] for data in rki.districts]
+        rnd = random.Random(0)
+
+        print("{:<10}{:>16}{:>16}{:>10}".format("cities", "former [us]", "fragments [us]", "speedup"))
+        for count in (1, 10, 50):
+            subscriptions = [corona.get_datas(rnd.sample(object_ids, count)) for _ in range(100)]
+            for datas in subscriptions:
+                if _normalized(corona.full_info(datas)) != _normalized(former.full_info(datas)):
+                    raise AssertionError("Messages differ for {}".format([d["OBJECTID"] for d in datas]))
+
+            former_time = min(timeit.repeat(lambda: [former.full_info(datas) for datas in subscriptions],
+                                            number=number, repeat=5))
+            fragment_time = min(timeit.repeat(lambda: [corona.full_info(datas) for datas in subscriptions],
+                                              number=number, repeat=5))
+            calls = number * len(subscriptions)
+            print("{:<10}{:>16.1f}{:>16.1f}{:>9.1f}x".format(count, former_time / calls * 1e6,
+                                                            fragment_time / calls * 1e6, former_time / fragment_time))
+    finally:
+        rki.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    run(number=20)
@@ -0,0 +1,138 @@
+"""Load test: hundreds of users sending /search and /info at once, right after an update of all cities/areas.
+
+Every user is a thread handing its commands to the bot's dispatcher, the replies go to a FakeBot without latency, so
+only the handling of the commands is measured. Runs once with and once without the response cache, each in a fresh
+interpreter.
+Run: python -m benchmarks.responses --users 400 --commands 5 --backend redislite
+"""
+import multiprocessing
+import random
+import shutil
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+
+from benchmarks.fake_rki import FakeRKI
+from benchmarks.fake_telegram import FakeBot, FakeTelegramAPI
+from benchmarks.synthetic import typo
+
+_POPULAR_CITIES = 30
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile))] if values else float("nan")
+
+
+def _users(names, object_ids, users, commands, seed=0):
+    # Most users follow one of the popular cities and search for it, some have a few cities and make typos
+    rnd = random.Random(seed)
+
+    subscriptions = {}
+    queries = {}
+    for chat_id in range(1, users + 1):
+        if rnd.random() < 0.7:
+            city = rnd.randrange(_POPULAR_CITIES)
+            subscriptions[chat_id] = [object_ids[city]]
+            queries[chat_id] = [names[city], names[city].lower()]
+        else:
+            subscriptions[chat_id] = rnd.sample(object_ids, rnd.randint(2, 5))
+            queries[chat_id] = [typo(rnd.choice(names), rnd)]
+
+    return subscriptions, {chat_id: ["/info" if rnd.random() < 0.5 else "/search " + rnd.choice(queries[chat_id])
+                                     for _ in range(commands)] for chat_id in subscriptions}
+
+
+def _run(directory, backend, rki_url, users, commands_per_user, cached, ready, go, results):
+    import config
+    config._config = {"telegramToken": "123:responses", "databaseDirectory": directory, "storageBackend": backend}
+
+    from telegram import Update
+
+    import corona
+    import telegram_bot
+    import user
+
+    corona.CORONA_API_URL = rki_url
+    corona.check_update()
+
+    datas = corona.get_datas(sorted(int(object_id) for object_id in corona._redis_corona.scan_keys()))
+    subscriptions, commands = _users([data["GEN"] for data in datas], [data["OBJECTID"] for data in datas], users,
+                                     commands_per_user)
+    for chat_id, object_ids in subscriptions.items():
+        for object_id in object_ids:
+            user.add_city(object_id, chat_id)
+
+    if not cached:
+        telegram_bot._cached_response = lambda command, cache, key, render: render()
+    telegram_bot.init()
+    dispatcher = telegram_bot._updater.dispatcher
+    bot = FakeBot(latency=0.0)
+
+    # Everybody asks right after the nightly update
+    ready.set()
+    go.wait()
+    corona.check_update()
+
+    latencies = []
+    barrier = threading.Barrier(users)
+
+    def _user(chat_id):
+        barrier.wait()
+        for i, command in enumerate(commands[chat_id]):
+            update = Update.de_json(FakeTelegramAPI.update_json(chat_id * 100 + i, chat_id, command), bot)
+            started = time.perf_counter()
+            dispatcher.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=_user, args=(chat_id,)) for chat_id in commands]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if len(bot.messages) != len(latencies):
+        raise AssertionError("{} commands, {} replies".format(len(latencies), len(bot.messages)))
+    results.put((elapsed, latencies, telegram_bot._single_flight.coalesced))
+
+
+def run(users, commands, backend):
+    rki = FakeRKI().start()
+    context = multiprocessing.get_context("spawn")
+    print("{} users sending {} commands each at once, {} backend".format(users, commands, backend))
+    print("{:<14}{:>12}{:>12}{:>12}{:>14}{:>12}".format("responses", "total [s]", "p50 [ms]", "p99 [ms]",
+                                                        "commands/s", "coalesced"))
+    try:
+        for name, cached in (("not cached", False), ("cached", True)):
+            directory = tempfile.mkdtemp()
+            rki.publish("01.11.2020, 00:00 Uhr")
+            try:
+                ready, go, results = context.Event(), context.Event(), context.Queue()
+                process = context.Process(target=_run, args=(directory, backend, rki.url, users, commands, cached,
+                                                             ready, go, results))
+                process.start()
+                ready.wait(600)
+                rki.publish("02.11.2020, 00:00 Uhr")
+                go.set()
+                elapsed, latencies, coalesced = results.get(timeout=600)
+                process.join()
+            finally:
+                shutil.rmtree(directory)
+            print("{:<14}{:>12.2f}{:>12.2f}{:>12.2f}{:>14.1f}{:>12}".format(
+                name, elapsed, _percentile(latencies, 0.5) * 1000, _percentile(latencies, 0.99) * 1000,
+                len(latencies) / elapsed, coalesced))
+    finally:
+        rki.stop()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--commands", type=int, default=5)
+    parser.add_argument("--backend", default="redislite")
+    args = parser.parse_args()
+
+    run(args.users, args.commands, args.backend)
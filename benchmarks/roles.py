@@ -0,0 +1,127 @@
+"""Runs the bot as separate processes (main.py -role ...) against a fake RKI and a fake Telegram API.
+
+Two ingest workers (one waits as standby), one commands process and N broadcast workers share one database. Reports
+how long it takes until every subscriber got the notification with 1 and with N broadcast workers, the /search latency
+while the broadcast runs and how long the standby needs to take over after the ingest worker was killed.
+Run: python -m benchmarks.roles --users 3000 --shards 4
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks.fake_rki import FakeRKI
+from benchmarks.fake_telegram import FakeTelegramAPI
+
+_SEARCHES = 200
+
+
+def _prepare(config, users):
+    import config as bot_config
+    bot_config._config = config
+
+    import corona
+    import user
+
+    corona.check_update()
+    object_ids = sorted(int(object_id) for object_id in corona._redis_corona.scan_keys())
+    for user_id in range(1, users + 1):
+        user.add_city(object_ids[user_id % len(object_ids)], user_id)
+
+
+def _start(directory, role, *args):
+    log = open(os.path.join(directory, "{}-{}.log".format(role, len(os.listdir(directory)))), "w")
+    return subprocess.Popen([sys.executable, "main.py", "-config", os.path.join(directory, "config.json"),
+                             "-role", role] + list(args), stdout=log, stderr=subprocess.STDOUT)
+
+
+def _notified(api, users):
+    return len(set(chat_id for chat_id, _ in list(api.replies) if chat_id <= users))
+
+
+def _wait_notified(api, users, count, timeout=300):
+    deadline = time.monotonic() + timeout
+    while _notified(api, users) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return _notified(api, users)
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))] if values else float("nan")
+
+
+def run_once(users, shards, takeover):
+    directory = tempfile.mkdtemp()
+    rki = FakeRKI().start()
+    api = FakeTelegramAPI().start()
+    processes = []
+    try:
+        config = {"telegramToken": "123:roles", "databaseDirectory": directory, "storageBackend": "sqlite",
+                  "coronaApiUrl": rki.url, "telegramApiUrl": api.base_url,
+                  "broadcastMessagesPerSecond": 100000, "broadcastWorkers": 8}
+        with open(os.path.join(directory, "config.json"), "w") as f:
+            json.dump(config, f)
+
+        process = multiprocessing.get_context("spawn").Process(target=_prepare, args=(config, users))
+        process.start()
+        process.join()
+
+        processes.append(_start(directory, "commands"))
+        for shard in range(shards):
+            processes.append(_start(directory, "broadcast", "-shard", str(shard), "-shards", str(shards)))
+        # Give the workers time to start, the clock starts with the ingest worker
+        time.sleep(3)
+
+        rki.publish("02.11.2020, 00:00 Uhr")
+        started = time.monotonic()
+        leader = _start(directory, "ingest")
+        processes.append(leader)
+        time.sleep(0.5)
+        processes.append(_start(directory, "ingest"))
+
+        # Searches from chats which aren't subscribed, while the notifications are sent
+        for chat_id in range(users + 1, users + 1 + _SEARCHES):
+            api.send_command(chat_id, "/search Landkreis")
+            time.sleep(0.005)
+
+        notified = _wait_notified(api, users, users)
+        elapsed = time.monotonic() - started
+        api.wait_for_replies(notified + _SEARCHES, timeout=30)
+        print("{} broadcast worker(s): {}/{} notified in {:.2f} s, /search p50 {:.1f} ms, p99 {:.1f} ms".format(
+            shards, notified, users, elapsed, _percentile(api.latencies, 50) * 1000,
+            _percentile(api.latencies, 99) * 1000))
+
+        if takeover:
+            replies = len(api.replies)
+            leader.kill()
+            leader.wait()
+            rki.publish("03.11.2020, 00:00 Uhr")
+            started = time.monotonic()
+            deadline = started + 120
+            while len(api.replies) < replies + users and time.monotonic() < deadline:
+                time.sleep(0.01)
+            print("standby took over: {} notifications {:.2f} s after the ingest worker was killed".format(
+                len(api.replies) - replies, time.monotonic() - started))
+    finally:
+        for process in processes:
+            process.kill()
+            process.wait()
+        api.stop()
+        rki.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--shards", type=int, default=4)
+    args = parser.parse_args()
+
+    run_once(args.users, 1, False)
+    run_once(args.users, args.shards, True)
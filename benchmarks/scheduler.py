@@ -0,0 +1,103 @@
+"""Simulates a month of RKI publications and compares the adaptive update scheduler with polling every hour and every
+minute.
+
+RKI publishes once a day at a random time around --publish-at. Reports the checks per day, overall and in the last
+week (the publication times are learned by then), and the time from the publication until the bot found the new data.
+The clock is simulated, nothing is fetched.
+Run: python -m benchmarks.scheduler --days 30 --publish-at 8:30 --spread 40
+"""
+import random
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+
+_DAY = 24 * 60 * 60
+
+
+class _Clock():
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def _publications(days, publish_at, spread, seed=0):
+    rnd = random.Random(seed)
+    hours, minutes = (int(part) for part in publish_at.split(":"))
+    first_day = datetime(2020, 11, 1)
+    return [(first_day + timedelta(days=day, hours=hours, minutes=minutes + rnd.uniform(-spread, spread))).timestamp()
+            for day in range(days)]
+
+
+def _simulate(publications, next_check):
+    # next_check(now, updated) returns when the next check runs
+    checks = []
+    latencies = []
+    pending = list(publications)
+    found = 0
+    now = publications[0] - 12 * 60 * 60
+    end = publications[-1] + _DAY
+    while now < end:
+        checks.append(now)
+        updated = 0
+        while found < len(pending) and pending[found] <= now:
+            latencies.append(now - pending[found])
+            found += 1
+            updated = 401
+        now = next_check(now, updated)
+    return checks, latencies
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))] if values else float("nan")
+
+
+def _report(name, publications, checks, latencies):
+    # The last week, after the publication times were learned
+    week = [check for check in checks if check >= publications[-1] - 6 * _DAY - 12 * 60 * 60]
+    print("{:<10} {:>6.1f} checks/day ({:>5.1f} in the last week), found after p50 {:>5.1f} min, p99 {:>5.1f} min, "
+          "max {:>5.1f} min".format(name, len(checks) / (len(publications) + 0.5), len(week) / 7.5,
+                                    _percentile(latencies, 50) / 60, _percentile(latencies, 99) / 60,
+                                    max(latencies) / 60))
+
+
+def run(days, publish_at, spread, idle_hours):
+    import tempfile
+
+    import config
+    config._config = {"databaseDirectory": tempfile.mkdtemp(), "storageBackend": "memory"}
+    from update_scheduler import UpdateScheduler
+
+    publications = _publications(days, publish_at, spread)
+
+    checks, latencies = _simulate(publications, lambda now, updated: now + idle_hours * 60 * 60)
+    _report("{:g} h".format(idle_hours), publications, checks, latencies)
+    checks, latencies = _simulate(publications, lambda now, updated: now + 60)
+    _report("1 min", publications, checks, latencies)
+
+    clock = _Clock(0)
+    scheduler = UpdateScheduler(idle_hours * 60 * 60, clock=clock)
+
+    def _next_check(now, updated):
+        clock.now = now
+        scheduler.checked(updated)
+        return scheduler.next_run
+
+    checks, latencies = _simulate(publications, _next_check)
+    _report("adaptive", publications, checks, latencies)
+    print("learned window: {}".format(scheduler.window()))
+
+
+if __name__ == '__main__':
+    import logging
+    logging.disable(logging.INFO)
+
+    parser = ArgumentParser()
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--publish-at", default="8:30")
+    parser.add_argument("--spread", type=float, default=40, help="Minutes RKI publishes earlier or later.")
+    parser.add_argument("--idle-hours", type=float, default=1)
+    args = parser.parse_args()
+
+    run(args.days, args.publish_at, args.spread, args.idle_hours)
@@ -0,0 +1,80 @@
+"""Cold start of the bot, broken down into import, bot setup (commands can be answered), storage and first sync.
+
+Every run is a fresh interpreter. The first sync fetches from a local fake RKI service.
+Run: python -m benchmarks.startup --backend redislite
+"""
+import multiprocessing
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks.fake_rki import FakeRKI
+
+
+def _start(directory, backend, rki_url, results):
+    timings = []
+    started = time.perf_counter()
+
+    def _step(name):
+        nonlocal started
+        now = time.perf_counter()
+        timings.append((name, (now - started) * 1000))
+        started = now
+
+    import config
+    config._config = {"telegramToken": "123:startup", "databaseDirectory": directory, "storageBackend": backend}
+
+    import corona
+    import notification
+    import telegram_bot
+    _step("import")
+
+    telegram_bot.init()
+    _step("bot ready")
+
+    corona._update_callback = notification.notify_users
+    corona.dataset_version()
+    _step("storage")
+
+    corona.CORONA_API_URL = rki_url
+    corona._update_callback = None
+    corona.check_update()
+    _step("first sync")
+
+    results.put(timings)
+
+
+def run(backend, runs):
+    rki = FakeRKI().start()
+    context = multiprocessing.get_context("spawn")
+    try:
+        all_timings = []
+        for _ in range(runs):
+            directory = tempfile.mkdtemp()
+            try:
+                results = context.Queue()
+                process = context.Process(target=_start, args=(directory, backend, rki.url, results))
+                process.start()
+                all_timings.append(results.get())
+                process.join()
+            finally:
+                shutil.rmtree(directory)
+    finally:
+        rki.stop()
+
+    print("backend: {}, median of {} cold starts".format(backend, runs))
+    total = 0
+    for i, (name, _) in enumerate(all_timings[0]):
+        value = sorted(timings[i][1] for timings in all_timings)[runs // 2]
+        total += value
+        print("{:<12}{:>10.1f} ms{:>12.1f} ms".format(name, value, total))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--backend", default="redislite")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    run(args.backend, args.runs)
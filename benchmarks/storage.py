@@ -0,0 +1,106 @@
+"""Runs the storage workloads of the bot against every storage backend.
+
+refresh: store all districts in one transaction, like corona._update_data
+search:  load all districts, like building the city search index
+fan-out: load the subscriptions of all users in batches and their districts, like notification.notify_users
+
+Run: python -m benchmarks.storage --users 10000
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from benchmarks.synthetic import districts
+from redis_storage import BACKENDS, RedisDB, create_connection
+
+
+def _refresh(corona, last_update, datas, version):
+    stored = last_update.mget([data["OBJECTID"] for data in datas])
+    pipeline = corona.pipeline()
+    last_update_pipeline = pipeline.namespaced(last_update)
+    for data, stored_last_update in zip(datas, stored):
+        if stored_last_update != data["last_update"]:
+            last_update_pipeline.set(data["OBJECTID"], data["last_update"])
+            pipeline.set(data["OBJECTID"], json.dumps(data))
+    pipeline.incr(version)
+    pipeline.execute()
+
+
+def _search(corona):
+    object_ids = list(corona.scan_keys())
+    return [json.loads(data) for data in corona.mget(object_ids) if data is not None]
+
+
+def _fan_out(user_city, user_ids, corona, batch_size=500):
+    messages = 0
+    for i in range(0, len(user_ids), batch_size):
+        pipeline = user_city.pipeline()
+        for user_id in user_ids[i:i + batch_size]:
+            pipeline.smembers(user_id)
+        for city_keys in pipeline.execute():
+            messages += len(corona.mget(list(city_keys)))
+    return messages
+
+
+def _time(function, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def run_backend(backend, directory, users):
+    rnd = random.Random(0)
+    started = time.perf_counter()
+    connection = create_connection(backend, os.path.join(directory, "{}.db".format(backend)))
+    open_ms = (time.perf_counter() - started) * 1000
+
+    corona = RedisDB(None, "corona", connection)
+    last_update = RedisDB(None, "last_updated", connection)
+    user_city = RedisDB(None, "user_city", connection)
+
+    day = [0]
+
+    def _next_refresh():
+        day[0] += 1
+        _refresh(corona, last_update, districts(last_update="{:02d}.11.2020, 00:00 Uhr".format(day[0] % 28 + 1)),
+                 "version")
+
+    refresh_ms = _time(_next_refresh)
+
+    user_ids = list(range(users))
+    pipeline = user_city.pipeline()
+    for user_id in user_ids:
+        for _ in range(rnd.randint(1, 5)):
+            pipeline.sadd(user_id, rnd.randint(1, 401))
+    pipeline.execute()
+
+    return open_ms, refresh_ms, _time(_search, corona), _time(_fan_out, user_city, user_ids, corona)
+
+
+def run(users, backends):
+    directory = tempfile.mkdtemp()
+    try:
+        print("{} districts, {} users".format(len(districts()), users))
+        print("{:<12}{:>12}{:>14}{:>14}{:>14}".format("backend", "open [ms]", "refresh [ms]", "search [ms]",
+                                                     "fan-out [ms]"))
+        for backend in backends:
+            print("{:<12}{:>12.1f}{:>14.1f}{:>14.1f}{:>14.1f}".format(backend, *run_backend(backend, directory, users)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    args = parser.parse_args()
+
+    run(args.users, args.backends)
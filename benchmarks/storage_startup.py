@@ -0,0 +1,58 @@
+"""Startup time and resident memory of the storage: one database per module vs. one shared database.
+
+Every scenario runs in a fresh process. RSS includes the redis-servers started by redislite.
+Run: python -m benchmarks.storage_startup --backend redislite
+"""
+import multiprocessing
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+
+_DATABASE_FILES = ["corona.db", "user.db"]
+
+
+def _open(directory, backend, shared, results):
+    import psutil
+
+    import config
+    config._config = {"databaseDirectory": directory, "storageBackend": backend}
+    if shared:
+        config._config["sharedDatabase"] = "bot.db"
+
+    import redis_storage
+    from redis_storage import RedisDB
+
+    started = time.perf_counter()
+    databases = [RedisDB(filename, "benchmark") for filename in _DATABASE_FILES]
+    for database in databases:
+        database.set("key", "value")
+    elapsed = time.perf_counter() - started
+
+    # redislite daemonizes its servers, they aren't children of this process
+    servers = [psutil.Process(server.pid) for server in redis_storage._redislite_servers]
+    processes = [psutil.Process()] + servers
+    results.put((elapsed * 1000, len(servers), sum(p.memory_info().rss for p in processes) / 1024 / 1024))
+
+
+def run(backend):
+    print("{:<10}{:>12}{:>10}{:>12}".format("databases", "open [ms]", "servers", "RSS [MB]"))
+    for shared in (False, True):
+        directory = tempfile.mkdtemp()
+        try:
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_open, args=(directory, backend, shared, results))
+            process.start()
+            elapsed, children, rss = results.get()
+            process.join()
+            print("{:<10}{:>12.1f}{:>10}{:>12.1f}".format("shared" if shared else "separate", elapsed, children, rss))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--backend", default="redislite")
+    args = parser.parse_args()
+
+    run(args.backend)
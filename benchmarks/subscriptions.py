@@ -0,0 +1,108 @@
+"""Compares loading the subscriptions for a notification with the bulk loader against reading them per user.
+
+The former fan-out asked the index for the subscribers of the changed cities/areas, then read the cities of every
+subscriber in pipelines of 500 users. Reports the time to group all users by their subscriptions, the storage
+round-trips and the memory the loaded subscriptions take per notified user.
+Run: python -m benchmarks.subscriptions --users 10000 --backend redislite
+"""
+import shutil
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from benchmarks.fake_rki import FakeRKI
+from benchmarks.synthetic import subscriptions
+
+_BATCH_SIZE = 500
+
+
+def _former_load(user, changed):
+    # The former notification._users, reading the cities of every subscriber
+    if changed is not None:
+        user_ids = list(user._redis_city_subscribers.sunion(changed))
+    else:
+        user_ids = user.users()
+    city_keys_by_user = {}
+    for i in range(0, len(user_ids), _BATCH_SIZE):
+        batch = user_ids[i:i + _BATCH_SIZE]
+        pipeline = user._redis_user_city.pipeline()
+        for user_id in batch:
+            pipeline.smembers(user_id)
+        city_keys_by_user.update(zip(batch, pipeline.execute()))
+    return city_keys_by_user, 1 + -(-len(user_ids) // _BATCH_SIZE)
+
+
+def _former_group(city_keys_by_user, changed):
+    # The former grouping in enqueue_notifications
+    user_ids_by_cities = {}
+    for user_id, city_keys in city_keys_by_user.items():
+        cities_key = frozenset(str(city_key) for city_key in city_keys)
+        if changed is not None:
+            cities_key = cities_key & changed
+        if len(cities_key) > 0:
+            user_ids_by_cities.setdefault(cities_key, []).append(user_id)
+    return user_ids_by_cities
+
+
+def _bulk_load(user, changed):
+    # SCAN of the cities if all are loaded, then one pipeline
+    return user.load_subscriptions(changed), 2 if changed is None else 1
+
+
+def _bulk_group(table, changed):
+    return {frozenset(city_keys): user_ids for city_keys, user_ids in table.groups()}
+
+
+def _measure(load, group, user, changed, repeats=5):
+    # The memory of the loaded subscriptions, without the groups
+    tracemalloc.start()
+    subscriptions, round_trips = load(user, changed)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del subscriptions
+
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        group(load(user, changed)[0], changed)
+        timings.append(time.perf_counter() - started)
+    return min(timings), round_trips, memory
+
+
+def run(users, backend):
+    directory = tempfile.mkdtemp()
+    rki = FakeRKI().start()
+    try:
+        import config
+        config._config = {"telegramToken": "123:subscriptions", "databaseDirectory": directory,
+                          "storageBackend": backend, "coronaApiUrl": rki.url}
+
+        import corona
+        import user
+
+        corona.check_update()
+        object_ids = sorted(int(object_id) for object_id in corona._redis_corona.scan_keys())
+        for chat_id, city_keys in subscriptions(object_ids, users).items():
+            for city_key in city_keys:
+                user.add_city(city_key, chat_id)
+
+        for name, changed in (("all cities", None),
+                              ("1/10 changed", frozenset(str(object_id) for object_id in object_ids[::10]))):
+            subscribed = len(user.load_subscriptions(changed))
+            for method, load, group in (("per user", _former_load, _former_group), ("bulk", _bulk_load, _bulk_group)):
+                seconds, round_trips, memory = _measure(load, group, user, changed)
+                print("{:<13} {:<9} {:>8.1f} ms {:>5} round-trips {:>10.1f} KB ({:.0f} bytes per user)".format(
+                    name, method, seconds * 1000, round_trips, memory / 1024, memory / subscribed))
+    finally:
+        rki.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--backend", default="redislite")
+    args = parser.parse_args()
+
+    run(args.users, args.backend)
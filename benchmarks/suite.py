@@ -0,0 +1,230 @@
+"""The benchmark suite: replays RKI updates against the bot offline and times the paths that matter in production.
+
+A local fake RKI service serves synthetic districts, a FakeBot stands in for Telegram and N synthetic users follow
+cities/areas like real users do (see synthetic.subscriptions). Every scenario runs in a fresh interpreter on the same
+database, so the peak RSS is the one of that scenario:
+
+- initial_sync: the first check_update, all districts
+- find_city: searches for names, lowercase names and typos
+- info: the uncached /info reply of every user
+- check_update: RKI publishes a tenth of the districts, the bot fetches and stores them
+- notify_users: RKI publishes all districts and every user is notified, latencies until each delivery
+
+Save the results of one commit and compare another one with them:
+Run: python -m benchmarks --users 10000 --json before.json
+     python -m benchmarks --users 10000 --compare before.json
+(python -m benchmarks is python -m benchmarks.suite.)
+"""
+import json
+import multiprocessing
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+from argparse import ArgumentParser
+from queue import Empty
+
+from benchmarks.fake_rki import FakeRKI
+from benchmarks.synthetic import subscriptions, typo
+
+SCENARIOS = ("initial_sync", "find_city", "info", "check_update", "notify_users")
+
+_UPDATE_ROUNDS = 20
+_SEARCHES = 2000
+
+
+def _setup(directory, backend, rki_url):
+    import config
+    config._config = {"telegramToken": "123:benchmark", "databaseDirectory": directory, "storageBackend": backend,
+                      "coronaApiUrl": rki_url, "broadcastMessagesPerSecond": 1000000, "broadcastWorkers": 8}
+
+
+def _timed(function, *args):
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+
+def _initial_sync(users, rki, notify_latency):
+    import corona
+    import user
+
+    latency = _timed(corona.check_update)
+
+    object_ids = sorted(int(object_id) for object_id in corona._redis_corona.scan_keys())
+    for chat_id, city_keys in subscriptions(object_ids, users).items():
+        for city_key in city_keys:
+            user.add_city(city_key, chat_id)
+    return [latency], len(object_ids)
+
+
+def _find_city(users, rki, notify_latency):
+    import corona
+
+    rnd = random.Random(0)
+    names = [data["GEN"] for data in rki.districts]
+    queries = [rnd.choice((name, name.lower(), typo(name, rnd))) for name in rnd.choices(names, k=_SEARCHES)]
+
+    # The index is built on first use
+    corona.find_city(names[0])
+    return [_timed(corona.find_city, query) for query in queries], len(queries)
+
+
+def _info(users, rki, notify_latency):
+    import telegram_bot
+    import user
+
+    return [_timed(lambda: telegram_bot._info_reply(user.city_keys(chat_id))) for chat_id in range(1, users + 1)], \
+        users
+
+
+def _check_update(users, rki, notify_latency):
+    import corona
+
+    rnd = random.Random(0)
+    object_ids = [data["OBJECTID"] for data in rki.districts]
+    latencies = []
+    for day in range(_UPDATE_ROUNDS):
+        rki.publish("{:02d}.12.2020, 00:00 Uhr".format(day + 1), set(rnd.sample(object_ids, len(object_ids) // 10)))
+        latencies.append(_timed(corona.check_update))
+    return latencies, _UPDATE_ROUNDS * (len(object_ids) // 10)
+
+
+def _notify_users(users, rki, notify_latency):
+    from types import SimpleNamespace
+
+    import corona
+    import notification
+    import telegram_bot
+    from benchmarks.fake_telegram import FakeBot
+
+    class _TimingBot(FakeBot):
+        def __init__(self):
+            super().__init__(latency=notify_latency)
+            self.sent_at = []
+
+        def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+            super().send_message(chat_id, text, parse_mode, **kwargs)
+            self.sent_at.append(time.perf_counter())
+
+    bot = _TimingBot()
+    telegram_bot._updater = SimpleNamespace(bot=bot)
+    corona._update_callback = notification.notify_users
+
+    rki.publish("01.01.2021, 00:00 Uhr")
+    started = time.perf_counter()
+    corona.check_update()
+    return [sent_at - started for sent_at in bot.sent_at], len(bot.sent_at)
+
+
+def _run(scenario, directory, backend, districts, users, notify_latency, results):
+    # The fake RKI continues where the previous scenario left it
+    rki = FakeRKI().start()
+    if districts is not None:
+        rki.districts = districts
+    try:
+        _setup(directory, backend, rki.url)
+        latencies, operations = globals()["_" + scenario](users, rki, notify_latency)
+        # Kilobytes on Linux
+        results.put((latencies, operations, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, rki.districts))
+    finally:
+        rki.stop()
+
+
+def _result(scenario, process, queue):
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                raise RuntimeError("Scenario {} failed, exit code {}.".format(scenario, process.exitcode))
+
+
+def _percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))] if values else float("nan")
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(users, backend, notify_latency, scenarios=SCENARIOS):
+    directory = tempfile.mkdtemp()
+    context = multiprocessing.get_context("spawn")
+    districts = None
+    results = {}
+    try:
+        for scenario in scenarios:
+            queue = context.Queue()
+            process = context.Process(target=_run, args=(scenario, directory, backend, districts, users,
+                                                         notify_latency, queue))
+            process.start()
+            latencies, operations, peak_rss, districts = _result(scenario, process, queue)
+            process.join()
+            if len(latencies) == 0:
+                raise RuntimeError("Scenario {} measured nothing, the {} backend must keep the data between the "
+                                   "scenario processes.".format(scenario, backend))
+
+            # Notifications run in parallel, their latencies are measured from the start
+            seconds = max(latencies) if scenario == "notify_users" else sum(latencies)
+            results[scenario] = {"operations": operations, "seconds": seconds,
+                                 "throughput": operations / seconds if seconds > 0 else None,
+                                 "p50_ms": _percentile(latencies, 50) * 1000,
+                                 "p99_ms": _percentile(latencies, 99) * 1000, "peak_rss_mb": peak_rss}
+    finally:
+        shutil.rmtree(directory)
+    return {"commit": _commit(), "users": users, "backend": backend, "results": results}
+
+
+def _print(report, baseline=None):
+    print("commit {}, {} users, {}".format(report["commit"], report["users"], report["backend"]))
+    print("{:<14} {:>10} {:>12} {:>10} {:>10} {:>9}".format("scenario", "operations", "ops/s", "p50 ms", "p99 ms",
+                                                            "RSS MB"))
+    for scenario, result in report["results"].items():
+        print("{:<14} {:>10} {:>12.1f} {:>10.3f} {:>10.3f} {:>9.1f}".format(
+            scenario, result["operations"], result["throughput"] or 0, result["p50_ms"], result["p99_ms"],
+            result["peak_rss_mb"]))
+        before = (baseline or {}).get("results", {}).get(scenario)
+        if before is not None:
+            print("{:<14} {:>10} {:>12} {:>10} {:>10} {:>9}".format(
+                "  vs " + str(baseline.get("commit")), "", _change(before["throughput"], result["throughput"]),
+                _change(before["p50_ms"], result["p50_ms"]), _change(before["p99_ms"], result["p99_ms"]),
+                _change(before["peak_rss_mb"], result["peak_rss_mb"])))
+
+
+def _change(before, after):
+    if not before or after is None:
+        return "-"
+    return "{:+.1f}%".format((after - before) / before * 100)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    # The memory backend doesn't outlive a scenario process
+    parser.add_argument("--backend", default="redislite", choices=("redislite", "sqlite"))
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every sent notification takes.")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--compare", help="Results of an earlier run (--json) to compare with.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = run(args.users, args.backend, args.latency)
+    _print(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
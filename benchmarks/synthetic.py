@@ -0,0 +1,72 @@
+import random
+from itertools import accumulate
+
+STATES = ["Baden-Württemberg", "Bayern", "Berlin", "Brandenburg", "Bremen", "Hamburg", "Hessen",
+          "Mecklenburg-Vorpommern", "Niedersachsen", "Nordrhein-Westfalen", "Rheinland-Pfalz", "Saarland", "Sachsen",
+          "Sachsen-Anhalt", "Schleswig-Holstein", "Thüringen"]
+
+_PREFIXES = ["Bad ", "", "", "", "", "Neu", "Alt", "Groß ", "Ober", "Unter"]
+_SYLLABLES = ["ber", "lin", "mün", "chen", "ham", "burg", "köl", "dorf", "stadt", "feld", "bach", "heim", "wald",
+              "hau", "sen", "lan", "ge", "nau", "kir", "rode", "wit", "ten", "gar", "mer", "zig", "ros", "tock", "ul"]
+_DESCRIPTIONS = ["Kreisfreie Stadt", "Landkreis", "Kreis", "Stadtkreis", "Bezirk"]
+
+DISTRICT_COUNT = 401
+
+
+def district_names(count=DISTRICT_COUNT, seed=42):
+    rnd = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        name = rnd.choice(_PREFIXES) + "".join(rnd.choice(_SYLLABLES) for _ in range(rnd.randint(2, 4)))
+        names.add(name[0].upper() + name[1:])
+    return sorted(names)
+
+
+def districts(count=DISTRICT_COUNT, seed=42, last_update="01.11.2020, 00:00 Uhr"):
+    """Returns ArcGIS-like attribute dicts for count synthetic districts."""
+    rnd = random.Random(seed)
+    state_incidence = {state: rnd.uniform(20, 250) for state in STATES}
+
+    result = []
+    for object_id, name in enumerate(district_names(count, seed), start=1):
+        state = rnd.choice(STATES)
+        cases = rnd.randint(50, 30000)
+        result.append({
+            "OBJECTID": object_id,
+            "BL": state,
+            "county": "LK " + name,
+            "GEN": name,
+            "BEZ": rnd.choice(_DESCRIPTIONS),
+            "last_update": last_update,
+            "cases7_per_100k": rnd.uniform(5, 400),
+            "cases_per_100k": rnd.uniform(100, 3000),
+            "cases7_bl_per_100k": state_incidence[state],
+            "cases": cases,
+        })
+    return result
+
+
+def typo(name, rnd, position=None):
+    position = rnd.randrange(len(name)) if position is None else position
+    return name[:position] + rnd.choice("abcdefghijklmnopqrstuvwxyz") + name[position + 1:]
+
+
+def subscriptions(object_ids, users, seed=0):
+    """Returns {chat_id: [object_id, ...]} for users 1..users, distributed like the subscriptions of a real bot.
+
+    Most users follow one or two cities/areas, few follow many. Cities are as popular as their rank (Zipf), so the
+    big cities have thousands of subscribers and many rural areas only a few.
+    """
+    rnd = random.Random(seed)
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(object_ids) + 1)))
+    popular = list(object_ids)
+    rnd.shuffle(popular)
+
+    result = {}
+    for chat_id in range(1, users + 1):
+        count = min(len(object_ids), 1 + int(rnd.expovariate(1 / 1.5)))
+        cities = set()
+        while len(cities) < count:
+            cities.add(rnd.choices(popular, cum_weights=cum_weights)[0])
+        result[chat_id] = sorted(cities)
+    return result
@@ -0,0 +1,88 @@
+"""Per-operation overhead of the storage tracing, compared with the former eager debug logging.
+
+The memory backend is used, so the overhead isn't hidden behind a round-trip to redis.
+Run: python -m benchmarks.tracing
+"""
+import io
+import logging
+import timeit
+
+import redis_storage
+import storage_tracing
+from memory_storage import MemoryStorage
+from redis_storage import RedisDB
+from storage_tracing import StorageTracer
+
+
+class FormerRedisDB(RedisDB):
+    # The former methods, formatting their debug output even if DEBUG is disabled
+
+    def get(self, key):
+        result = self.redis_connection.get(self._ns_key(key))
+        redis_storage.logger.debug("GET: {} - {}".format(self._ns_key(key), result))
+        return result
+
+    def smembers(self, key):
+        result = self.redis_connection.smembers(self._ns_key(key))
+        redis_storage.logger.debug("SMEMBERS: {} - {}".format(key, result))
+        return result
+
+    def mget(self, keys):
+        ns_keys = [self._ns_key(key) for key in keys]
+        if len(ns_keys) == 0:
+            return []
+        result = self.redis_connection.mget(ns_keys)
+        redis_storage.logger.debug("MGET: {} keys - {} found".format(len(ns_keys),
+                                                                     len([r for r in result if r is not None])))
+        return result
+
+
+def _operations(db):
+    keys = [str(i) for i in range(100)]
+    return {
+        "get": lambda: db.get("1"),
+        "mget (100 keys)": lambda: db.mget(keys),
+        "smembers (1000)": lambda: db.smembers("members"),
+    }
+
+
+def _fill(connection):
+    db = RedisDB("benchmark", "benchmark", connection)
+    db.mset({str(i): "x" * 100 for i in range(100)})
+    for i in range(1000):
+        db.sadd("members", i)
+
+
+def _per_op(function, number):
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def run(number):
+    connection = MemoryStorage()
+    _fill(connection)
+
+    # Traced operations are formatted by a real handler, but not printed
+    trace_logger = storage_tracing.logger
+    trace_logger.addHandler(logging.StreamHandler(io.StringIO()))
+    trace_logger.setLevel(logging.DEBUG)
+    trace_logger.propagate = False
+
+    variants = [
+        ("former logging", FormerRedisDB("benchmark", "benchmark", connection), None),
+        ("disabled", RedisDB("benchmark", "benchmark", connection), None),
+        ("slow > 100 ms", RedisDB("benchmark", "benchmark", connection), StorageTracer(slow_ms=100)),
+        ("sampled 1%", RedisDB("benchmark", "benchmark", connection), StorageTracer(sample_rate=0.01)),
+        ("all", RedisDB("benchmark", "benchmark", connection), StorageTracer(sample_rate=1.0)),
+    ]
+
+    operations = list(_operations(variants[0][1]))
+    print("{:<18}".format("[us/op]") + "".join("{:>18}".format(name) for name in operations))
+    for name, db, tracer in variants:
+        redis_storage.set_tracer(tracer)
+        timings = [_per_op(operation, number) for operation in _operations(db).values()]
+        print("{:<18}".format(name) + "".join("{:>18.2f}".format(timing) for timing in timings))
+    redis_storage.set_tracer(None)
+
+
+if __name__ == '__main__':
+    run(number=20000)
@@ -0,0 +1,90 @@
+"""POSTs recorded updates to a local webhook.WebhookServer and reports its queue depth and handling latency.
+
+Replies go to a local fake Bot API. Run: python -m benchmarks.webhook --updates 500 --concurrency 20
+"""
+import json
+import time
+import urllib.request
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+from telegram.ext import CommandHandler, Updater
+
+from benchmarks.fake_telegram import FakeTelegramAPI
+from webhook import SECRET_TOKEN_HEADER, WebhookServer
+
+_TOKEN = "123:benchmark"
+_SECRET = "benchmark-secret"
+
+
+def _post(url, update, secret=_SECRET):
+    request = urllib.request.Request(url, data=json.dumps(update).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json", SECRET_TOKEN_HEADER: secret})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+
+def _deliver(url, update):
+    # Like Telegram: an update that wasn't accepted is sent again later. Returns the number of rejections.
+    rejections = 0
+    while _post(url, update) == 503:
+        rejections += 1
+        time.sleep(0.05)
+    return rejections
+
+
+def run(updates, concurrency, storage_latency, queue_size, workers):
+    api = FakeTelegramAPI().start()
+
+    def _info(update, context):
+        time.sleep(storage_latency)
+        update.message.reply_text("Info for {}".format(update.message.chat_id))
+
+    updater = Updater(_TOKEN, base_url=api.base_url, use_context=True)
+    updater.dispatcher.add_handler(CommandHandler("info", _info))
+
+    server = WebhookServer(updater.bot, updater.dispatcher, port=0, secret_token=_SECRET, queue_size=queue_size,
+                           workers=workers).start()
+    url = "http://127.0.0.1:{}{}".format(server.port, server.path)
+
+    assert _post(url, FakeTelegramAPI.update_json(0, 0, "/info"), secret="wrong") == 403
+
+    recorded = [FakeTelegramAPI.update_json(update_id, update_id, "/info") for update_id in range(1, updates + 1)]
+    started = time.monotonic()
+    max_queue_depth = 0
+    rejections = 0
+    with ThreadPoolExecutor(concurrency) as executor:
+        for rejected in executor.map(lambda update: _deliver(url, update), recorded):
+            rejections += rejected
+            max_queue_depth = max(max_queue_depth, server.stats()["queue_depth"])
+
+    while server.stats()["handled"] < updates:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - started
+
+    stats = server.stats()
+    server.stop()
+    api.stop()
+
+    print("{} updates, {} concurrent senders, queue size {}, {} workers, {:.0f} ms per command".format(
+        updates, concurrency, queue_size, workers, storage_latency * 1000))
+    print("rejected (503) and retried: {}, max queue depth: {}".format(rejections, max_queue_depth))
+    print("handled: {} in {:.2f} s ({:.1f} updates/s), latency p50: {:.1f} ms, p99: {:.1f} ms".format(
+        stats["handled"], elapsed, stats["handled"] / elapsed, stats["latency_p50"] * 1000,
+        stats["latency_p99"] * 1000))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--storage_latency", type=float, default=0.01)
+    parser.add_argument("--queue_size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    run(args.updates, args.concurrency, args.storage_latency, args.queue_size, args.workers)
@@ -0,0 +1,235 @@
+import logging
+import queue
+import threading
+import time
+
+from telegram import ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, Unauthorized
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Limits documented by Telegram: about 30 messages per second in total and one message per second to the same chat
+GLOBAL_MESSAGES_PER_SECOND = 30
+CHAT_MESSAGES_PER_SECOND = 1
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 1.0
+
+_messages = metrics.Counter("broadcast_messages_total", "Broadcast messages by result.", ["result"])
+_retries = metrics.Counter("broadcast_retries_total", "Retried attempts to send a broadcast message.")
+_send_duration = metrics.Histogram("broadcast_send_duration_seconds", "Duration of one sendMessage call.")
+_throughput = metrics.Gauge("broadcast_throughput_messages_per_second", "Throughput of the last broadcast.")
+
+
+def is_retryable(error):
+    """Returns whether sending a message which failed with error may succeed later."""
+    return isinstance(error, (RetryAfter, NetworkError)) and not isinstance(error, BadRequest)
+
+
+class TokenBucket():
+    """Thread-safe token bucket. acquire() blocks until a token is available.
+
+    The default capacity of one token spreads the messages evenly instead of allowing bursts.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        # Nobody gets a token for the given time, e.g. because Telegram asked us to wait (RetryAfter)
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._updated = self._paused_until
+
+
+class BroadcastProgress():
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.queued = 0
+        self.failures = {}
+        self.started = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        return self.queued - self.sent - self.failed
+
+    @property
+    def elapsed(self):
+        return (self.finished if self.finished is not None else time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        elapsed = self.elapsed
+        return self.sent / elapsed if elapsed > 0 else 0.0
+
+    def _count(self, attribute, chat_id=None, error=None):
+        if attribute == "retries":
+            _retries.inc()
+        else:
+            _messages.inc(attribute)
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+            if error is not None:
+                self.failures[chat_id] = error
+
+    def __str__(self):
+        return "sent: {}, failed: {}, remaining: {}, retries: {}, {:.1f} messages/s".format(
+            self.sent, self.failed, self.remaining, self.retries, self.throughput)
+
+
+class Broadcaster():
+    """Sends messages with a pool of worker threads, respecting the global and the per chat rate limit.
+
+    bot can be any object providing send_message(chat_id=..., text=..., parse_mode=...) like telegram.Bot.
+    RetryAfter pauses all workers for the requested time, network errors are retried with exponential backoff.
+    Unauthorized (the user blocked the bot), BadRequest, any other TelegramError (e.g. ChatMigrated) and unexpected
+    exceptions are not retried.
+
+    If given, delivery_callback(message, error) is called once per message with its final outcome, error is None if it
+    was sent.
+    """
+
+    def __init__(self, bot, workers=DEFAULT_WORKERS, rate=GLOBAL_MESSAGES_PER_SECOND,
+                 chat_rate=CHAT_MESSAGES_PER_SECOND, max_retries=DEFAULT_MAX_RETRIES,
+                 retry_backoff=DEFAULT_RETRY_BACKOFF, progress_callback=None, progress_interval=10.0,
+                 delivery_callback=None):
+        self.bot = bot
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.delivery_callback = delivery_callback
+
+        self._global_bucket = TokenBucket(rate)
+        self._chat_buckets = {}
+        self._chat_buckets_lock = threading.Lock()
+        self._last_report = 0.0
+
+    def broadcast(self, messages):
+        """Sends all (chat_id, text, ...) tuples of messages and blocks until all of them are sent or failed."""
+        progress = BroadcastProgress()
+        jobs = queue.Queue(maxsize=self.workers * 4)
+
+        threads = [threading.Thread(target=self._work, args=(jobs, progress), daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        for message in messages:
+            progress.queued += 1
+            jobs.put(message)
+        for _ in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+
+        progress.finished = time.monotonic()
+        _throughput.set(progress.throughput)
+        self._report(progress, force=True)
+        return progress
+
+    def _work(self, jobs, progress):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            try:
+                error = self._send(job[0], job[1], progress)
+            except Exception as e:
+                # A dead worker would leave broadcast() blocked on the full queue
+                logger.exception("Sending to {} failed.".format(job[0]))
+                progress._count("failed", job[0], e)
+                error = e
+            if self.delivery_callback is not None:
+                try:
+                    self.delivery_callback(job, error)
+                except Exception:
+                    logger.exception("Delivery callback failed for {}.".format(job[0]))
+            self._report(progress)
+
+    def _send(self, chat_id, text, progress):
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            chat_bucket.acquire()
+            self._global_bucket.acquire()
+            try:
+                with _send_duration.time():
+                    self.bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+                progress._count("sent")
+                return None
+            except RetryAfter as e:
+                logger.warning("Flood control exceeded. Pausing for {} seconds.".format(e.retry_after))
+                self._global_bucket.pause(e.retry_after)
+                error = e
+            except (Unauthorized, BadRequest) as e:
+                logger.info("Not retrying message to {}: {}".format(chat_id, e))
+                progress._count("failed", chat_id, e)
+                return e
+            except NetworkError as e:
+                time.sleep(self.retry_backoff * 2 ** attempt)
+                error = e
+            except TelegramError as e:
+                logger.warning("Not retrying message to {}: {}".format(chat_id, e))
+                progress._count("failed", chat_id, e)
+                return e
+            except Exception as e:
+                logger.exception("Sending to {} failed.".format(chat_id))
+                progress._count("failed", chat_id, e)
+                return e
+
+            attempt += 1
+            if attempt > self.max_retries:
+                logger.warning("Giving up sending to {} after {} attempts: {}".format(chat_id, attempt, error))
+                progress._count("failed", chat_id, error)
+                return error
+            progress._count("retries")
+
+    def _chat_bucket(self, chat_id):
+        with self._chat_buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self.chat_rate, capacity=1)
+                self._chat_buckets[chat_id] = bucket
+            return bucket
+
+    def _report(self, progress, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self.progress_interval:
+            return
+        self._last_report = now
+
+        if self.progress_callback is not None:
+            self.progress_callback(progress)
+        else:
+            logger.info("Broadcast progress - {}".format(progress))
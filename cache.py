@@ -0,0 +1,102 @@
+import threading
+from collections import OrderedDict
+
+
+class VersionedCache():
+    """Thread-safe key/value cache bound to a dataset version.
+
+    Values are only stored if they were loaded for the current version, so a reader racing with an update can't put
+    stale data back into the cache. If maxsize is set, the least recently used entries are evicted.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                if self.maxsize is not None:
+                    self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, version):
+        with self._lock:
+            if version != self.version:
+                return False
+            self._entries[key] = value
+            if self.maxsize is not None:
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            return True
+
+    def invalidate(self, version, entries=None):
+        # Switches to the new version. Without entries, everything is dropped. Otherwise only the given entries are
+        # replaced, all other keys are known to be unchanged in the new version.
+        with self._lock:
+            self.version = version
+            if entries is None:
+                self._entries.clear()
+            else:
+                for key, value in entries.items():
+                    self._entries[key] = value
+                if self.maxsize is not None:
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+
+
+class SingleFlight():
+    """Concurrent calls with the same key share one computation.
+
+    The first caller of do(key, function) computes, callers arriving until it is done wait for its result (or its
+    exception). Nothing is kept afterwards, combine it with a cache.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class _Call():
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
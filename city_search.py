@@ -0,0 +1,132 @@
+import threading
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+_NGRAM_SIZE = 3
+_PADDING = " " * (_NGRAM_SIZE - 1)
+
+# Minimum SequenceMatcher ratio for a fuzzy (non substring) match
+MIN_SIMILARITY = 0.8
+# Candidates sharing fewer n-grams (Dice coefficient) are not compared with the (slow) SequenceMatcher
+MIN_NGRAM_SIMILARITY = 0.3
+MAX_FUZZY_CANDIDATES = 50
+
+
+def normalize(name):
+    return " ".join(str(name).upper().split())
+
+
+def _ngrams(value):
+    padded = _PADDING + value + _PADDING
+    return set(padded[i:i + _NGRAM_SIZE] for i in range(len(padded) - _NGRAM_SIZE + 1))
+
+
+class CitySearchIndex():
+    """In-memory trigram index over city/area names.
+
+    Names are padded on both sides, so a typo in the first letter still shares most of its n-grams with the correct
+    name. Updates are incremental: update() only touches the postings of the changed entry.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._names = {}
+        self._gram_counts = {}
+        self._postings = defaultdict(set)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, object_id):
+        return object_id in self._names
+
+    def update(self, object_id, name):
+        name = normalize(name)
+        with self._lock:
+            old_name = self._names.get(object_id)
+            if old_name == name:
+                return
+            if old_name is not None:
+                self._remove_postings(object_id, old_name)
+
+            grams = _ngrams(name)
+            self._names[object_id] = name
+            self._gram_counts[object_id] = len(grams)
+            for gram in grams:
+                self._postings[gram].add(object_id)
+
+    def remove(self, object_id):
+        with self._lock:
+            name = self._names.pop(object_id, None)
+            if name is not None:
+                del self._gram_counts[object_id]
+                self._remove_postings(object_id, name)
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self._gram_counts.clear()
+            self._postings.clear()
+
+    def _remove_postings(self, object_id, name):
+        for gram in _ngrams(name):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(object_id)
+                if len(posting) == 0:
+                    del self._postings[gram]
+
+    def search(self, name, limit=None):
+        """Returns the ids of all matching entries, best match first.
+
+        An entry matches if the query is a substring of its name or if both are similar enough (see MIN_SIMILARITY).
+        Prefix matches rank before other substring matches, which rank before fuzzy matches.
+        """
+        query = normalize(name)
+        if len(query) == 0:
+            return []
+
+        with self._lock:
+            if len(query) < _NGRAM_SIZE:
+                # Too short for n-grams, a scan over the names is cheap enough
+                substring_ids = [object_id for object_id, city in self._names.items() if query in city]
+                fuzzy_candidates = []
+            else:
+                query_grams = _ngrams(query)
+                shared_grams = defaultdict(int)
+                for gram in query_grams:
+                    for object_id in self._postings.get(gram, ()):
+                        shared_grams[object_id] += 1
+
+                substring_ids = []
+                fuzzy_candidates = []
+                for object_id, shared in shared_grams.items():
+                    if query in self._names[object_id]:
+                        substring_ids.append(object_id)
+                    else:
+                        dice = 2 * shared / (len(query_grams) + self._gram_counts[object_id])
+                        if dice >= MIN_NGRAM_SIMILARITY:
+                            fuzzy_candidates.append((dice, object_id))
+                fuzzy_candidates.sort(reverse=True)
+                fuzzy_candidates = [object_id for _, object_id in fuzzy_candidates[:MAX_FUZZY_CANDIDATES]]
+
+            ranked = []
+            for object_id in substring_ids:
+                city = self._names[object_id]
+                ranked.append((0 if city.startswith(query) else 1, -len(query) / len(city), city, object_id))
+
+            # SequenceMatcher caches information about its second sequence, so the query goes there
+            matcher = SequenceMatcher(None, autojunk=False)
+            matcher.set_seq2(query)
+            for object_id in fuzzy_candidates:
+                city = self._names[object_id]
+                matcher.set_seq1(city)
+                if matcher.real_quick_ratio() < MIN_SIMILARITY or matcher.quick_ratio() < MIN_SIMILARITY:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= MIN_SIMILARITY:
+                    ranked.append((2, -ratio, city, object_id))
+
+        ranked.sort(key=lambda entry: entry[:3])
+        object_ids = [entry[3] for entry in ranked]
+        return object_ids if limit is None else object_ids[:limit]
@@ -1,15 +1,34 @@
+import asyncio
 import json
 import logging
-from difflib import SequenceMatcher
-
-import requests
-
+import threading
+import time
+from collections import namedtuple
+
+import fetch
+import history
+import metrics
+from cache import VersionedCache
+from city_search import CitySearchIndex
+from county_stats import CountyTable
+from config import get_config
+from feature_stream import iter_feature_attributes
 from redis_storage import RedisDB, get_pure_db_key
 
 logger = logging.getLogger(__name__)
 
-CORONA_API_URL = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/RKI_Landkreisdaten/FeatureServer/0/query?where=1%3D1&outFields=OBJECTID,BL,county,GEN,BEZ,last_update,cases7_per_100k,cases_per_100k,cases7_bl_per_100k,cases&returnGeometry=false&outSR=4326&f=json"
-CORONA_UPDATE_API_URL = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/RKI_Landkreisdaten/FeatureServer/0/query?where=1%3D1&outFields=OBJECTID,last_update&returnGeometry=false&outSR=4326&f=json"
+CORONA_API_URL = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/RKI_Landkreisdaten/FeatureServer/0/query"
+CORONA_DATA_FIELDS = "OBJECTID,BL,county,GEN,BEZ,last_update,cases7_per_100k,cases_per_100k,cases7_bl_per_100k,cases"
+CORONA_UPDATE_FIELDS = "OBJECTID,last_update"
+
+# If more cities/areas changed, all data is fetched instead of a long OBJECTID IN (...) filter
+_MAX_DELTA_OBJECT_IDS = 200
+# Number of streamed features compared with the stored data in one round-trip
+_UPDATE_BATCH_SIZE = 100
+
+# Snapshots read to show the trend of a city/area, enough to cover the last week with some missing days
+_TREND_SNAPSHOTS = 10
+_DAY_SECONDS = 24 * 60 * 60
 
 C_OBJECT_ID = "OBJECTID"
 C_STATE = "BL"
@@ -25,92 +44,292 @@ C_CASES = "cases"
 _DATABSE_FILE = "corona.db"
 _redis_last_update = RedisDB(_DATABSE_FILE, "last_updated")
 _redis_corona = RedisDB(_DATABSE_FILE, "corona")
-_redis_corona_city_search = RedisDB(_DATABSE_FILE, "corona_city_search")
+_redis_meta = RedisDB(_DATABSE_FILE, "corona_meta")
 
-_update_callback = None
+_META_VERSION = "version"
+# Validators (ETag, Last-Modified, body hash) of the last processed update check
+_META_VALIDATORS = "validators"
+# Ids of changed cities/areas whose subscribers weren't notified yet, stored together with the changes
+_META_UNNOTIFIED = "unnotified"
 
+# Decoded county records of the current dataset version, keyed by object id
+_record_cache = VersionedCache()
+# Formatted parts of the messages about a county, keyed by object id. Rendered when its data changes, a message is
+# only joined from them.
+_fragment_cache = VersionedCache()
 
-def check_update():
-    respone = requests.get(CORONA_UPDATE_API_URL)
-    data = json.loads(respone.text)
+Fragments = namedtuple("Fragments", ["last_update", "label", "cases7", "city_info", "state"])
 
-    if "features" in data:
-        features = data["features"]
-        for feature in features:
-            if 'attributes' in feature:
-                attributes = feature['attributes']
+# Built on the first search, None until then or after another process changed the data
+_search_index = None
+_search_index_lock = threading.Lock()
 
-                stored_last_update = _redis_last_update.get(attributes[C_OBJECT_ID])
-                if stored_last_update is None or str(stored_last_update) < attributes[C_LAST_UPDATE]:
-                    logger.info("Found old data. Updating all data...")
-                    _update_data()
-                    break
+# Column-oriented copy of all cities/areas for the nationwide statistics, rebuilt by the first query of a new version
+_county_table = None
+_county_table_lock = threading.Lock()
 
+# Another process (e.g. a separate ingest worker) can store new data, the stored version is checked this often
+_VERSION_CHECK_INTERVAL = 5
+_version_checked_at = 0.0
 
-def _update_data():
-    respone = requests.get(CORONA_API_URL)
-    data = json.loads(respone.text)
+_changed_counties = metrics.Histogram("corona_refresh_changed_counties", "Cities/Areas changed per refresh.",
+                                      buckets=(0, 1, 5, 10, 25, 50, 100, 200, 300, 400, 500))
+_refresh_duration = metrics.Histogram("corona_refresh_duration_seconds",
+                                      "Duration of fetching and storing changed data, without notifications.")
+_dataset_version = metrics.Gauge("corona_dataset_version", "Current version of the stored dataset.")
+
+_update_callback = None
 
-    if "features" in data:
-        features = data["features"]
-        for feature in features:
-            if 'attributes' in feature:
-                attributes = feature['attributes']
-                object_id = attributes[C_OBJECT_ID]
 
-                stored_last_update = _redis_last_update.get(object_id)
-                if stored_last_update is None or str(stored_last_update) < attributes[C_LAST_UPDATE]:
-                    logger.info("Update/Insert Data. ObjectId: {}".format(attributes[C_OBJECT_ID]))
+def _query_params(out_fields, where="1=1"):
+    return {"where": where, "outFields": out_fields, "returnGeometry": "false", "outSR": "4326", "f": "json"}
 
-                    # Update last updated
-                    _redis_last_update.set(object_id, attributes[C_LAST_UPDATE])
 
-                    # Store corona data
-                    _redis_corona.set(object_id, json.dumps(attributes))
+def _api_url():
+    # Can point to a mirror of the RKI service or a local stub
+    return get_config().get("coronaApiUrl", CORONA_API_URL)
 
-                    # Store corona data - hashed by first character of the city name
-                    city_first_char = attributes[C_CITY_AREA][0].upper()
-                    _redis_corona_city_search.sadd(city_first_char, object_id)
-                else:
-                    logger.info("Data up-to-date. ObjectId {}".format(attributes[C_OBJECT_ID]))
 
-    if _update_callback is not None:
-        _update_callback()
+def check_update():
+    """Returns the number of updated cities/areas."""
+    # Revalidated against the last response, polling costs almost nothing as long as RKI didn't publish new data
+    result = fetch.get(_api_url(), _query_params(CORONA_UPDATE_FIELDS), validators=_stored_validators(),
+                       name="last_update")
+    return _process_update_check(result)
+
+
+async def check_update_async(executor):
+    # The update check doesn't block the event loop. Storage access and a possible update run on the executor.
+    validators = await asyncio.get_event_loop().run_in_executor(executor, _stored_validators)
+    result = await fetch.get_async(_api_url(), _query_params(CORONA_UPDATE_FIELDS), validators=validators,
+                                   name="last_update")
+    return await asyncio.get_event_loop().run_in_executor(executor, _process_update_check, result)
+
+
+def _stored_validators():
+    # Stored with the data they vouch for: if the data is lost or another database is used, so are they
+    return json.loads(_redis_meta.get(_META_VALIDATORS) or "{}")
+
+
+def _process_update_check(result):
+    if result.unchanged:
+        logger.info("Data up-to-date.")
+        return 0
+
+    stale_object_ids = []
+    for attributes_list in _batches(iter_feature_attributes([result.content]), _UPDATE_BATCH_SIZE):
+        stored_last_updates = _redis_last_update.mget([attributes[C_OBJECT_ID] for attributes in attributes_list])
+        stale_object_ids.extend(attributes[C_OBJECT_ID]
+                                for attributes, stored_last_update in zip(attributes_list, stored_last_updates)
+                                if _is_stale(stored_last_update, attributes))
+
+    if len(stale_object_ids) > 0:
+        logger.info("Found old data. Updating {} cities/areas...".format(len(stale_object_ids)))
+        _update_data(stale_object_ids, result.validators)
+    else:
+        _redis_meta.set(_META_VALIDATORS, json.dumps(result.validators))
+    return len(stale_object_ids)
+
+
+def _is_stale(stored_last_update, attributes):
+    # last_update is formatted like "01.11.2020, 00:00 Uhr" and can't be compared lexicographically
+    return stored_last_update is None or str(stored_last_update) != attributes[C_LAST_UPDATE]
+
+
+def _update_data(object_ids=None, validators=None):
+    # validators of the update check are stored with the changes, the next check is only answered "unchanged" if the
+    # data it found is stored
+    started = time.perf_counter()
+    if object_ids is None or len(object_ids) > _MAX_DELTA_OBJECT_IDS:
+        where = "1=1"
+    else:
+        where = "OBJECTID IN ({})".format(",".join(str(int(object_id)) for object_id in object_ids))
+    # Features are compared and queued for storing while the rest of the response is still downloading
+    features = iter_feature_attributes(fetch.stream(_api_url(), _query_params(CORONA_DATA_FIELDS, where)))
+
+    # All changes are written in one transaction, readers never see a half-applied update
+    pipeline = _redis_corona.pipeline()
+    last_update_pipeline = pipeline.namespaced(_redis_last_update)
+    meta_pipeline = pipeline.namespaced(_redis_meta)
+
+    updated = []
+    received_count = 0
+    for attributes_list in _batches(features, _UPDATE_BATCH_SIZE):
+        # One round-trip for the stored versions of the whole batch instead of one GET per county
+        stored_last_updates = _redis_last_update.mget([attributes[C_OBJECT_ID] for attributes in attributes_list])
+        received_count += len(attributes_list)
+
+        for attributes, stored_last_update in zip(attributes_list, stored_last_updates):
+            object_id = attributes[C_OBJECT_ID]
+
+            if _is_stale(stored_last_update, attributes):
+                logger.debug("Update/Insert Data. ObjectId: {}".format(object_id))
+
+                # Update last updated
+                last_update_pipeline.set(object_id, attributes[C_LAST_UPDATE])
+
+                # Store corona data
+                pipeline.set(object_id, json.dumps(attributes))
+
+                # Keep the values of this update for the trends
+                history.append(pipeline, object_id, attributes[C_LAST_UPDATE], attributes[C_CASES7_PER_100K],
+                               attributes[C_CASES])
+
+                if _update_callback is not None:
+                    meta_pipeline.sadd(_META_UNNOTIFIED, object_id)
+
+                updated.append(attributes)
+            else:
+                logger.debug("Data up-to-date. ObjectId {}".format(object_id))
+
+    if validators is not None:
+        meta_pipeline.set(_META_VALIDATORS, json.dumps(validators))
+    if len(updated) > 0:
+        meta_pipeline.incr(_META_VERSION)
+        version = pipeline.execute()[-1]
+
+        _configure()
+        _record_cache.invalidate(version, {str(attributes[C_OBJECT_ID]): attributes for attributes in updated})
+        _fragment_cache.invalidate(version, {str(attributes[C_OBJECT_ID]): fragments
+                                             for attributes, fragments in zip(updated, _render_fragments(updated))})
+        _update_search_index(updated)
+        history.trim([attributes[C_OBJECT_ID] for attributes in updated])
+        _dataset_version.set(version)
+    elif validators is not None:
+        pipeline.execute()
+    logger.info("Updated {} of {} cities/areas.".format(len(updated), received_count))
+    _changed_counties.observe(len(updated))
+    _refresh_duration.observe(time.perf_counter() - started)
+
+    # Only called with the ids of the changed cities/areas, nobody has to be notified if nothing changed
+    if len(updated) > 0 and _update_callback is not None:
+        _update_callback(set(str(attributes[C_OBJECT_ID]) for attributes in updated))
+
+
+def unnotified():
+    """Returns the ids of the changed cities/areas whose subscribers weren't notified yet, e.g. after a crash."""
+    return _redis_meta.smembers(_META_UNNOTIFIED)
+
+
+def mark_notified(pipeline, object_ids):
+    # Queued on a pipeline of the same database, e.g. to commit it together with the enqueued messages
+    meta_pipeline = pipeline.namespaced(_redis_meta)
+    for object_id in object_ids:
+        meta_pipeline.srem(_META_UNNOTIFIED, object_id)
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _update_search_index(updated):
+    # Before the first search the index is built from the database anyway
+    search_index = _search_index
+    if search_index is not None:
+        for attributes in updated:
+            search_index.update(str(attributes[C_OBJECT_ID]), attributes[C_CITY_AREA])
+
+
+def _get_search_index():
+    global _search_index
+
+    if _search_index is None:
+        with _search_index_lock:
+            if _search_index is None:
+                search_index = CitySearchIndex()
+                object_ids = list(_redis_corona.scan_keys())
+                for object_id, corona_data in zip(object_ids, _redis_corona.mget(object_ids)):
+                    if corona_data is not None:
+                        search_index.update(object_id, json.loads(corona_data)[C_CITY_AREA])
+                logger.info("Built city search index. Cities/Areas: {}".format(len(search_index)))
+                _search_index = search_index
+    return _search_index
 
 
 def find_city(name):
     if not name or not isinstance(name, str) or len(name) <= 0:
         raise ValueError("Invalid input for name: {}".format(name))
 
-    name_upper = name.upper()
+    object_ids = _get_search_index().search(name)
+
+    return [corona_data for corona_data in get_datas(object_ids) if corona_data is not None]
+
+
+def county_table():
+    """Returns the CountyTable of the current dataset version, built from the stored data on first use."""
+    global _county_table
 
-    potential_object_ids = _redis_corona_city_search.smembers(name_upper[0])
+    version = dataset_version()
+    table = _county_table
+    if table is None or table.version != version:
+        with _county_table_lock:
+            table = _county_table
+            if table is None or table.version != version:
+                datas = get_datas(list(_redis_corona.scan_keys()))
+                table = CountyTable([(data[C_OBJECT_ID], data[C_CITY_AREA], data[C_CITY_AREA_DESCRIPTION], data[C_STATE],
+                                      data[C_CASES7_PER_100K], data[C_CASES], data[C_CASES7_BL_PER_100K])
+                                     for data in datas if data is not None], version)
+                logger.info("Built county statistics of version {}. Cities/Areas: {}".format(version, len(table)))
+                _county_table = table
+    return table
 
-    matching_cities = []
-    for object_id in potential_object_ids:
-        corona_data = _redis_corona.get(object_id)
 
-        if corona_data is None:
-            continue
+def _configure():
+    # Configured on first use, before the caches get a version. Importing this module doesn't read the configuration.
+    if _record_cache.version is None:
+        _record_cache.maxsize = get_config().get("recordCacheSize")
 
-        corona_data = json.loads(corona_data)
-        city_upper = corona_data[C_CITY_AREA].upper()
 
-        if name_upper in city_upper or SequenceMatcher(None, name_upper, city_upper).ratio() >= 0.8:
-            matching_cities.append(corona_data)
+def dataset_version():
+    global _search_index, _version_checked_at
 
-    return matching_cities
+    now = time.monotonic()
+    if _record_cache.version is None or now - _version_checked_at >= _VERSION_CHECK_INTERVAL:
+        _version_checked_at = now
+        _configure()
+
+        version = int(_redis_meta.get(_META_VERSION) or 0)
+        if _record_cache.version is None or version > _record_cache.version:
+            if _record_cache.version is not None:
+                # Changed by another process, which cities/areas changed isn't known here
+                logger.info("Dataset changed to version {}.".format(version))
+                _search_index = None
+            _fragment_cache.invalidate(version)
+            _record_cache.invalidate(version)
+            _dataset_version.set(version)
+    return _record_cache.version
 
 
 def get_data(object_id):
-    corona_data = _redis_corona.get(object_id)
-    if corona_data is None:
-        return None
+    return get_datas([object_id])[0]
+
+
+def get_datas(object_ids):
+    # Read-through: cached records are returned without touching redis, all misses are loaded with one MGET
+    version = dataset_version()
+    keys = [str(object_id) for object_id in object_ids]
 
-    return json.loads(corona_data)
+    result = [_record_cache.get(key) for key in keys]
+    missing = [i for i, corona_data in enumerate(result) if corona_data is None]
+    if len(missing) > 0:
+        for i, corona_data in zip(missing, _redis_corona.mget([keys[i] for i in missing])):
+            if corona_data is not None:
+                result[i] = json.loads(corona_data)
+                _record_cache.put(keys[i], result[i], version)
+
+    return result
 
 
 def exists(object_id):
+    if _record_cache.get(str(object_id)) is not None:
+        return True
     return True if _redis_corona.exists(object_id) >= 1 else False
 
 
@@ -123,67 +342,93 @@ def full_info(data):
         data = [data]
 
     sorted_data = sorted(data, key=lambda x: x[C_CITY_AREA])
+    fragments = get_fragments(sorted_data)
 
-    states_info = full_states_info(sorted_data)
+    return "\n\n".join([_states_info(fragments), _cities_info(fragments), _landscape_quick_info(fragments)])
 
-    cities_info = "\n\n".join([full_city_info(d) for d in sorted_data])
-    cities_info = "<u>Cities/Areas</u>:\n" + cities_info
 
-    landscape_quick_info = city_landscape_quick_info(sorted_data)
+def get_fragments(datas):
+    # Read-through like get_datas: the fragments of a county are rendered once per update of its data.
+    # dataset_version() gives the cache its first version, put() would drop everything before that.
+    version = dataset_version()
+    result = [_fragment_cache.get(str(data[C_OBJECT_ID])) for data in datas]
 
-    info = "{}\n\n{}\n\n{}".format(states_info, cities_info, landscape_quick_info)
+    missing = [i for i, fragments in enumerate(result)
+               if fragments is None or fragments.last_update != datas[i][C_LAST_UPDATE]]
+    if len(missing) > 0:
+        for i, fragments in zip(missing, _render_fragments([datas[i] for i in missing])):
+            result[i] = fragments
+            _fragment_cache.put(str(datas[i][C_OBJECT_ID]), fragments, version)
 
-    return info
+    return result
 
 
-def city_landscape_quick_info(datas):
-    cities_and_cases7 = [("{} ({})".format(data[C_CITY_AREA], data[C_CITY_AREA_DESCRIPTION]),
-                          "{:.2f}".format(data[C_CASES7_PER_100K])
-                          ) for data in datas]
+def _render_fragments(datas):
+    snapshots = history.last_many([data[C_OBJECT_ID] for data in datas], _TREND_SNAPSHOTS)
+
+    result = []
+    for data in datas:
+        label = "{} ({})".format(data[C_CITY_AREA], data[C_CITY_AREA_DESCRIPTION])
+        cases7 = "{:.2f}".format(data[C_CASES7_PER_100K])
+
+        city_info = ["<b>{}</b> ({}) - (ID: {})".format(data[C_CITY_AREA], data[C_CITY_AREA_DESCRIPTION],
+                                                       data[C_OBJECT_ID]),
+                     "\tCases last 7 days per 100k: <b>{}</b>".format(cases7),
+                     "\tCases: {}".format(data[C_CASES]),
+                     "\tLast update: {}".format(data[C_LAST_UPDATE])]
+        trend = _trend_info(data, snapshots[data[C_OBJECT_ID]])
+        if trend:
+            city_info.append(trend)
 
-    longest_city_name = max([len(city_cases7[0]) for city_cases7 in cities_and_cases7])
-    longest_cases7 = max([len(city_cases7[1]) for city_cases7 in cities_and_cases7])
+        result.append(Fragments(last_update=data[C_LAST_UPDATE], label=label, cases7=cases7,
+                                city_info="\n".join(city_info),
+                                state="{}: {:.2f}".format(data[C_STATE], data[C_CASES7_BL_PER_100K])))
+    return result
 
-    info = "_" * (longest_city_name + longest_cases7 + 5)
-    info += "\n"
-    for city, cases7 in cities_and_cases7:
-        city = _fill_whitespace(city, longest_city_name)
-        cases7 = _fill_whitespace(cases7, longest_cases7, left=True)
-        info += "|{} | {}|".format(city, cases7)
-        info += "\n"
-    info += "-" * (longest_city_name + longest_cases7 + 5)
 
-    info = "<u>Quick overview</u> (use landscape mode):\n<pre>{}</pre>".format(info)
-    return info
+def full_states_info(datas):
+    return _states_info(get_fragments(datas))
 
 
-def _fill_whitespace(value, length, left=False):
-    if len(value) < length:
-        if left:
-            return (" " * (length - len(value))) + value
-        return value + " " * (length - len(value))
-    elif len(value) > length:
-        raise ValueError("{} has more than {} characters.".format(value, length))
-    return value
+def _states_info(fragments):
+    # Each state once, in the order of the cities/areas
+    states = dict.fromkeys(fragment.state for fragment in fragments)
+    return "<u>States</u> - cases last 7 days per 100k:\n" + "\n\t".join(states)
 
 
 def full_city_info(data):
-    info = "<b>{}</b> ({}) - (ID: {})".format(data[C_CITY_AREA], data[C_CITY_AREA_DESCRIPTION], data[C_OBJECT_ID])
-    info += "\n"
-    info += "\tCases last 7 days per 100k: <b>{:.2f}</b>".format(data[C_CASES7_PER_100K])
-    info += "\n"
-    info += "\tCases: {}".format(data[C_CASES])
-    info += "\n"
-    info += "\tLast update: {}".format(data[C_LAST_UPDATE])
+    return get_fragments([data])[0].city_info
 
-    return info
 
+def _cities_info(fragments):
+    return "<u>Cities/Areas</u>:\n" + "\n\n".join([fragment.city_info for fragment in fragments])
 
-def full_states_info(datas):
-    states = set([(d[C_STATE], d[C_CASES7_BL_PER_100K]) for d in datas])
 
-    info = "<u>States</u> - cases last 7 days per 100k:"
-    info += "\n"
-    info += "\n\t".join(["{}: {:.2f}".format(*state) for state in states])
+def city_landscape_quick_info(datas):
+    return _landscape_quick_info(get_fragments(datas))
+
 
-    return info
+def _landscape_quick_info(fragments):
+    longest_city_name = max([len(fragment.label) for fragment in fragments])
+    longest_cases7 = max([len(fragment.cases7) for fragment in fragments])
+
+    rows = ["_" * (longest_city_name + longest_cases7 + 5)]
+    rows.extend(["|{} | {}|".format(fragment.label.ljust(longest_city_name), fragment.cases7.rjust(longest_cases7))
+                 for fragment in fragments])
+    rows.append("-" * (longest_city_name + longest_cases7 + 5))
+
+    return "<u>Quick overview</u> (use landscape mode):\n<pre>{}</pre>".format("\n".join(rows))
+
+
+def _trend_info(data, snapshots):
+    current = history.parse_last_update(data[C_LAST_UPDATE])
+
+    changes = []
+    for label, snapshot in (("previous update", history.at(snapshots, current - 1)),
+                            ("last week", history.at(snapshots, current - 7 * _DAY_SECONDS))):
+        if snapshot is not None:
+            changes.append("{:+.2f} since {}".format(data[C_CASES7_PER_100K] - snapshot.cases7_per_100k, label))
+
+    if len(changes) == 0:
+        return None
+    return "\tTrend: {}".format(", ".join(changes))
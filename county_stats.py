@@ -0,0 +1,94 @@
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+from city_search import normalize
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+County = namedtuple("County", ["object_id", "name", "description", "state", "cases7_per_100k", "cases"])
+StateStats = namedtuple("StateStats", ["name", "cases7_per_100k", "counties", "cases", "median", "minimum", "maximum",
+                                       "rows"])
+
+
+class CountyTable():
+    """All cities/areas of one dataset version in columns, for nationwide statistics.
+
+    The rows are ordered by the 7-day incidence, highest first, so the ranking is the row number. The state
+    aggregates and the percentiles are computed once when the table is built, queries only slice and bisect.
+    """
+
+    def __init__(self, counties, version=None):
+        """counties are (object_id, name, description, state, cases7_per_100k, cases, state_cases7_per_100k)."""
+        self.version = version
+        counties = sorted(counties, key=lambda county: county[4], reverse=True)
+
+        self.state_names = sorted(set(county[3] for county in counties))
+        state_index = {state: i for i, state in enumerate(self.state_names)}
+
+        self.object_ids = array("q", (county[0] for county in counties))
+        self.names = [county[1] for county in counties]
+        self.descriptions = [county[2] for county in counties]
+        self.states = array("B", (state_index[county[3]] for county in counties))
+        self.cases7 = array("d", (county[4] for county in counties))
+        self.cases = array("q", (county[5] for county in counties))
+
+        # Ascending copy for bisect
+        self._ascending_cases7 = array("d", reversed(self.cases7))
+        self.percentiles = {percentile: _percentile(self._ascending_cases7, percentile) for percentile in PERCENTILES}
+
+        state_cases7 = {county[3]: county[6] for county in counties}
+        rows_by_state = [array("H") for _ in self.state_names]
+        for row, state in enumerate(self.states):
+            rows_by_state[state].append(row)
+        self.state_stats = [self._state_stats(name, state_cases7[name], rows)
+                            for name, rows in zip(self.state_names, rows_by_state)]
+        # States by their 7-day incidence, highest first
+        self.state_ranking = sorted(self.state_stats, key=lambda stats: stats.cases7_per_100k, reverse=True)
+        self._states_by_name = {normalize(name): stats for name, stats in zip(self.state_names, self.state_stats)}
+
+    def _state_stats(self, name, cases7_per_100k, rows):
+        # rows are in ranking order, the first has the highest incidence
+        ascending = array("d", (self.cases7[row] for row in reversed(rows)))
+        return StateStats(name=name, cases7_per_100k=cases7_per_100k, counties=len(rows),
+                          cases=sum(self.cases[row] for row in rows), median=_percentile(ascending, 50),
+                          minimum=ascending[0], maximum=ascending[-1], rows=rows)
+
+    def __len__(self):
+        return len(self.object_ids)
+
+    def county(self, row):
+        return County(self.object_ids[row], self.names[row], self.descriptions[row],
+                      self.state_names[self.states[row]], self.cases7[row], self.cases[row])
+
+    def top(self, count):
+        """Returns the count cities/areas with the highest 7-day incidence."""
+        return [self.county(row) for row in range(min(count, len(self)))]
+
+    def count_above(self, threshold):
+        return len(self) - bisect_right(self._ascending_cases7, threshold)
+
+    def above(self, threshold, limit=None):
+        """Returns the cities/areas with a 7-day incidence above threshold, highest first, at most limit."""
+        count = self.count_above(threshold)
+        return [self.county(row) for row in range(count if limit is None else min(count, limit))]
+
+    def state(self, name):
+        """Returns the StateStats of the state matching name (exactly or by a unique prefix), None if there is none."""
+        name = normalize(name)
+        stats = self._states_by_name.get(name)
+        if stats is not None:
+            return stats
+        matches = [stats for state_name, stats in self._states_by_name.items() if state_name.startswith(name)]
+        return matches[0] if len(matches) == 1 else None
+
+    def state_counties(self, stats, count=None):
+        rows = stats.rows if count is None else stats.rows[:count]
+        return [self.county(row) for row in rows]
+
+
+def _percentile(ascending, percentile):
+    # Nearest rank
+    if len(ascending) == 0:
+        return None
+    return ascending[min(len(ascending) - 1, max(0, -(-len(ascending) * percentile // 100) - 1))]
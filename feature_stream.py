@@ -0,0 +1,70 @@
+import codecs
+import json
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+_FEATURES_START = re.compile(r'"features"\s*:\s*\[')
+_WHITESPACE = re.compile(r'[\s,]*')
+# Enough of the buffer is kept while searching, so "features": [ can't be missed if it's split between two chunks
+_FEATURES_START_MAX_LENGTH = 64
+
+
+def iter_features(chunks):
+    """Yields the features of an ArcGIS JSON response one by one, while the chunks (bytes) are still arriving.
+
+    Only a single feature has to be held in memory in its parsed form, the rest of the response is never parsed.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+
+    buffer = ""
+    position = None
+    for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        match = _FEATURES_START.search(buffer)
+        if match is not None:
+            position = match.end()
+            break
+        buffer = buffer[-_FEATURES_START_MAX_LENGTH:]
+
+    if position is None:
+        logger.warning("Response doesn't contain any features.")
+        return
+
+    exhausted = False
+    while True:
+        position = _WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            if buffer[position] == "]":
+                return
+            try:
+                feature, end = json_decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Most likely the feature isn't complete yet
+                if exhausted:
+                    raise
+            else:
+                yield feature
+                position = end
+                continue
+        elif exhausted:
+            raise ValueError("Response ended within the list of features.")
+
+        # Drop everything parsed so far and read the next chunk
+        buffer = buffer[position:]
+        position = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += decoder.decode(b"", final=True)
+            exhausted = True
+        else:
+            buffer += decoder.decode(chunk)
+
+
+def iter_feature_attributes(chunks):
+    for feature in iter_features(chunks):
+        if 'attributes' in feature:
+            yield feature['attributes']
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+STREAM_CHUNK_SIZE = 16 * 1024
+
+_duration = metrics.Histogram("fetch_duration_seconds", "Duration of HTTP requests to the data sources.", ["request"])
+_responses = metrics.Counter("fetch_responses_total", "HTTP responses of the data sources by status.",
+                             ["request", "status"])
+_received_bytes = metrics.Counter("fetch_received_bytes_total", "Decompressed bytes received from the data sources.",
+                                  ["request"])
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    # One session for all requests: connections (and TLS handshakes) are reused between the polls
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                # Imported on first use, requests takes a noticeable part of the startup time
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                session = requests.Session()
+                retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers["Accept-Encoding"] = "gzip, deflate"
+                _session = session
+    return _session
+
+
+class FetchResult():
+    def __init__(self, content, unchanged, validators=None):
+        # None if the server answered 304
+        self.content = content
+        # True if the server answered 304 or sent exactly the same body as last time
+        self.unchanged = unchanged
+        # Revalidates the next request. Store them only after the response has been processed successfully,
+        # otherwise a failed update would be considered up-to-date on the next poll.
+        self.validators = validators
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def get(url, params=None, validators=None, name="get", timeout=DEFAULT_TIMEOUT):
+    """GETs url with the shared session.
+
+    If validators are given (FetchResult.validators of the last response, {} if there is none), the request is
+    revalidated with If-None-Match/If-Modified-Since and FetchResult.unchanged tells whether the content differs from
+    the last one. The caller stores the validators, e.g. together with the data they vouch for. name labels the
+    request in the metrics.
+    """
+    request_key = _request_key(url, params)
+    headers = _conditional_headers(validators, request_key)
+
+    started = time.perf_counter()
+    response = get_session().get(request_key, headers=headers, timeout=timeout)
+    _observe(name, started, response.status_code, len(response.content))
+    if response.status_code != 304:
+        response.raise_for_status()
+
+    return _result(validators, request_key, response.status_code, response.content, response.headers)
+
+
+async def get_async(url, params=None, validators=None, name="get", timeout=DEFAULT_TIMEOUT):
+    """Like get(), but doesn't block the event loop. Uses tornado's AsyncHTTPClient."""
+    from tornado.httpclient import AsyncHTTPClient
+
+    request_key = _request_key(url, params)
+    headers = _conditional_headers(validators, request_key)
+
+    started = time.perf_counter()
+    response = await AsyncHTTPClient().fetch(request_key, headers=headers, request_timeout=timeout,
+                                             decompress_response=True, raise_error=False)
+    _observe(name, started, response.code, len(response.body or b""))
+    if response.code != 304:
+        response.rethrow()
+
+    return _result(validators, request_key, response.code, response.body or b"", response.headers)
+
+
+def _request_key(url, params):
+    import requests
+
+    return requests.Request("GET", url, params=params).prepare().url
+
+
+def _conditional_headers(validators, request_key):
+    headers = {}
+    # Validators of another request (e.g. after the URL was configured differently) don't apply
+    if validators and validators.get("request") == request_key:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("lastModified"):
+            headers["If-Modified-Since"] = validators["lastModified"]
+    return headers
+
+
+def _result(validators, request_key, status_code, content, headers):
+    if validators is None:
+        logger.debug("GET {} - {} bytes".format(request_key, len(content)))
+        return FetchResult(content, False)
+
+    if status_code == 304 and validators.get("request") == request_key:
+        logger.debug("GET {} - not modified".format(request_key))
+        return FetchResult(None, True)
+
+    logger.debug("GET {} - {} bytes".format(request_key, len(content)))
+    # Not every server supports conditional requests, comparing the body at least saves the processing
+    sha1 = hashlib.sha1(content).hexdigest()
+    unchanged = validators.get("request") == request_key and sha1 == validators.get("sha1")
+    return FetchResult(content, unchanged, {"request": request_key, "etag": headers.get("ETag"),
+                                            "lastModified": headers.get("Last-Modified"), "sha1": sha1})
+
+
+def stream(url, params=None, timeout=DEFAULT_TIMEOUT, chunk_size=STREAM_CHUNK_SIZE):
+    """GETs url with the shared session and yields the (decompressed) body in chunks while it is downloaded."""
+    started = time.perf_counter()
+    with get_session().get(url, params=params, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        received = 0
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                received += len(chunk)
+                yield chunk
+        finally:
+            # Also if the consumer stops early. Includes its processing of the chunks, the download overlaps with it.
+            logger.debug("GET {} - {} bytes".format(response.url, received))
+            _observe("stream", started, response.status_code, received)
+
+
+def _observe(request, started, status_code, received):
+    _duration.observe(time.perf_counter() - started, request)
+    _responses.inc(request, str(status_code))
+    _received_bytes.inc(request, amount=received)
@@ -0,0 +1,99 @@
+import base64
+import bisect
+import logging
+import struct
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from config import get_config
+from redis_storage import RedisDB
+
+logger = logging.getLogger(__name__)
+
+# Same database as the corona data, so snapshots are appended in the same transaction as the data is stored
+_DATABSE_FILE = "corona.db"
+_redis_history = RedisDB(_DATABSE_FILE, "history")
+
+# timestamp (uint32), cases7_per_100k (float32), cases (uint32). 12 bytes are exactly 16 base64 characters without
+# padding, so encoded snapshots can be appended to and sliced from a plain string value.
+_RECORD = struct.Struct("<IfI")
+_ENCODED_RECORD_SIZE = 16
+
+DEFAULT_RETENTION = 400
+# A history is only rewritten (trimmed) if it exceeds the retention by this many snapshots
+_TRIM_SLACK = 30
+
+_LAST_UPDATE_FORMAT = "%d.%m.%Y, %H:%M Uhr"
+
+Snapshot = namedtuple("Snapshot", ["timestamp", "cases7_per_100k", "cases"])
+
+
+def _retention():
+    return get_config().get("historyRetention", DEFAULT_RETENTION)
+
+
+def parse_last_update(last_update):
+    try:
+        return int(datetime.strptime(last_update, _LAST_UPDATE_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        logger.warning("Unknown last_update format: {}".format(last_update))
+        return int(time.time())
+
+
+def encode(snapshot):
+    return base64.b64encode(_RECORD.pack(*snapshot)).decode("ascii")
+
+
+def decode(encoded):
+    if not encoded:
+        return []
+    return [Snapshot(*values) for values in _RECORD.iter_unpack(base64.b64decode(encoded))]
+
+
+def append(pipeline, object_id, last_update, cases7_per_100k, cases):
+    """Queues appending a snapshot on the given pipeline of the corona database."""
+    snapshot = Snapshot(parse_last_update(last_update), cases7_per_100k, cases)
+    pipeline.namespaced(_redis_history).append(object_id, encode(snapshot))
+
+
+def last(object_id, count):
+    """Returns the last count snapshots of the city/area, oldest first."""
+    return decode(_redis_history.getrange(object_id, -count * _ENCODED_RECORD_SIZE, -1))
+
+
+def last_many(object_ids, count):
+    pipeline = _redis_history.pipeline()
+    for object_id in object_ids:
+        pipeline.getrange(object_id, -count * _ENCODED_RECORD_SIZE, -1)
+    return {object_id: decode(encoded) for object_id, encoded in zip(object_ids, pipeline.execute())}
+
+
+def between(object_id, start, end=None):
+    """Returns all snapshots with start <= timestamp < end, oldest first."""
+    snapshots = decode(_redis_history.get(object_id))
+    timestamps = [snapshot.timestamp for snapshot in snapshots]
+    end_index = len(snapshots) if end is None else bisect.bisect_left(timestamps, end)
+    return snapshots[bisect.bisect_left(timestamps, start):end_index]
+
+
+def at(snapshots, timestamp):
+    """Returns the latest of the (sorted) snapshots that isn't newer than timestamp."""
+    index = bisect.bisect_right([snapshot.timestamp for snapshot in snapshots], timestamp)
+    return snapshots[index - 1] if index > 0 else None
+
+
+def trim(object_ids):
+    retention = _retention()
+    max_length = (retention + _TRIM_SLACK) * _ENCODED_RECORD_SIZE
+
+    pipeline = _redis_history.pipeline()
+    for object_id in object_ids:
+        pipeline.strlen(object_id)
+    too_long = [object_id for object_id, length in zip(object_ids, pipeline.execute()) if length > max_length]
+
+    for object_id in too_long:
+        # The history is only appended by the update, which is also the only one trimming it
+        _redis_history.set(object_id, _redis_history.getrange(object_id, -retention * _ENCODED_RECORD_SIZE, -1))
+    if len(too_long) > 0:
+        logger.info("Trimmed history of {} cities/areas to {} snapshots.".format(len(too_long), retention))
@@ -2,10 +2,23 @@ import logging
 import threading
 import time
 
-import schedule
-
 logger = logging.getLogger(__name__)
 
+RUNTIME_THREADED = "threaded"
+RUNTIME_ASYNCIO = "asyncio"
+
+UPDATE_MODE_POLLING = "polling"
+UPDATE_MODE_WEBHOOK = "webhook"
+
+# Everything in one process, or one part of the bot per process sharing the storage
+ROLE_ALL = "all"
+ROLE_INGEST = "ingest"
+ROLE_COMMANDS = "commands"
+ROLE_BROADCAST = "broadcast"
+
+# Seconds a broadcast worker waits before it looks for new messages again, if its shard had none
+_BROADCAST_POLL_INTERVAL = 2
+
 
 def main():
     from argparse import ArgumentParser, ArgumentTypeError, ArgumentError
@@ -32,40 +45,163 @@ def main():
     parser.add_argument("-config", "--c", type=_check_configuration_file,
                         help="A configuration file to use.")
     parser.add_argument("-corona_update_interval", "--cui", type=_check_positive, default=1,
-                        help="The interval in hours how often the corona data should be updated. Default is every hour.")
+                        help="The interval in hours how often the corona data should be updated while the time RKI "
+                             "usually publishes isn't known yet or RKI is late. Default is every hour.")
+    parser.add_argument("-runtime", "--r", choices=[RUNTIME_THREADED, RUNTIME_ASYNCIO],
+                        help="Run the bot with threads (default) or on an asyncio event loop.")
+    parser.add_argument("-update_mode", "--um", choices=[UPDATE_MODE_POLLING, UPDATE_MODE_WEBHOOK],
+                        help="Receive updates by long polling (default) or by a webhook (threaded runtime only).")
+    parser.add_argument("-role", "--ro", choices=[ROLE_ALL, ROLE_INGEST, ROLE_COMMANDS, ROLE_BROADCAST],
+                        default=ROLE_ALL,
+                        help="Run everything (default) or only the data updates (one process, others wait as standby), "
+                             "the commands or a broadcast worker.")
+    parser.add_argument("-shard", "--s", type=int, default=0,
+                        help="The chats this broadcast worker sends to: chat id %% shards == shard.")
+    parser.add_argument("-shards", "--ss", type=_check_positive, default=1,
+                        help="Number of broadcast workers, the same for all of them.")
+    parser.add_argument("-metrics_port", "--mp", type=int,
+                        help="Port of the metrics endpoint, overrides metricsPort. Every process needs its own.")
 
     args = parser.parse_args()
 
+    import config
     if args.c:
-        import config
         config._config = args.c
 
-    start(args.cui)
+    runtime = args.r or config.get_config().get("runtime", RUNTIME_THREADED)
+    update_mode = args.um or config.get_config().get("updateMode", UPDATE_MODE_POLLING)
+    if runtime == RUNTIME_ASYNCIO and update_mode == UPDATE_MODE_WEBHOOK:
+        parser.error("The webhook update mode requires the threaded runtime.")
+    if not 0 <= args.s < args.ss:
+        parser.error("The shard must be between 0 and {}.".format(args.ss - 1))
+    if args.mp is not None:
+        config.get_config()["metricsPort"] = args.mp
 
+    start(args.cui, runtime, update_mode, args.ro, args.s, args.ss)
 
-def start(corona_update_interval):
+
+def start(corona_update_interval, runtime=RUNTIME_THREADED, update_mode=UPDATE_MODE_POLLING, role=ROLE_ALL,
+          shard=0, shards=1):
     import telegram_bot
     import corona
     import notification
 
+    _start_metrics_server()
+
+    if role == ROLE_INGEST:
+        _run_ingest(corona_update_interval)
+        return
+    if role == ROLE_BROADCAST:
+        _run_broadcast(shard, shards)
+        return
+
     # Set up telegram, corona can use it.
     telegram_bot.init()
 
+    if role == ROLE_COMMANDS:
+        # The data is updated and the notifications are sent by the other roles
+        _receive_updates(runtime, update_mode, None)
+        return
+
     corona._update_callback = notification.notify_users
-    corona.check_update()
 
-    th = threading.Thread(target=_schedule_jobs, args=(corona_update_interval, corona.check_update))
-    th.start()
+    # Notifications interrupted by a restart are finished in the background
+    threading.Thread(target=_run_job, args=(notification.resume,), daemon=True).start()
+
+    if runtime == RUNTIME_THREADED:
+        # The initial sync runs in the background, commands are answered right away
+        th = threading.Thread(target=_schedule_jobs, args=(corona_update_interval, corona.check_update))
+        th.start()
+
+    _receive_updates(runtime, update_mode, corona_update_interval)
+
+
+def _receive_updates(runtime, update_mode, corona_update_interval):
+    import telegram_bot
+
+    if runtime == RUNTIME_ASYNCIO:
+        # Updates are checked on the event loop, no scheduler thread needed
+        telegram_bot.poll_async(corona_update_interval * 60 * 60 if corona_update_interval is not None else None)
+        return
 
     # Infinite loop
-    telegram_bot.poll()
+    if update_mode == UPDATE_MODE_WEBHOOK:
+        telegram_bot.serve_webhook()
+    else:
+        telegram_bot.poll()
+
+
+def _run_ingest(corona_update_interval):
+    import corona
+    import notification
+    from process_lock import ProcessLock
+
+    # Only one process updates the data, the others wait and take over if it dies
+    lock = ProcessLock(ROLE_INGEST)
+    if not lock.acquire():
+        logger.info("Another ingest worker is running, waiting as standby.")
+        lock.acquire(blocking=True)
+    logger.info("Running as the ingest worker.")
+
+    # The broadcast workers send the notifications
+    corona._update_callback = notification.enqueue_notifications
+    _run_job(notification.resume, send=False)
+
+    _schedule_jobs(corona_update_interval, corona.check_update)
+
+
+def _run_broadcast(shard, shards):
+    import outbox
+    import telegram_bot
+    from broadcast import GLOBAL_MESSAGES_PER_SECOND
+    from config import get_config
+    from process_lock import ProcessLock
+
+    lock = ProcessLock("{}-{}-of-{}".format(ROLE_BROADCAST, shard, shards))
+    if not lock.acquire():
+        raise RuntimeError("Shard {} of {} has a broadcast worker already.".format(shard, shards))
+    logger.info("Running as broadcast worker for shard {} of {}.".format(shard, shards))
+
+    telegram_bot.init()
+
+    # Telegram's limit applies to the bot, all workers together stay below it
+    rate = get_config().get("broadcastMessagesPerSecond", GLOBAL_MESSAGES_PER_SECOND) / shards
+
+    def _broadcast(messages, delivery_callback):
+        return telegram_bot.broadcast(messages, delivery_callback, rate=rate)
+
+    while True:
+        try:
+            progress = outbox.drain(_broadcast, shard, shards)
+        except Exception:
+            logger.exception("Broadcast failed.")
+            progress = None
+        if progress is None or progress.queued == 0:
+            time.sleep(_BROADCAST_POLL_INTERVAL)
+
+
+def _start_metrics_server():
+    import metrics
+    from config import get_config
+
+    port = get_config().get("metricsPort")
+    if port is not None:
+        metrics.MetricsServer(get_config().get("metricsListen", metrics.DEFAULT_LISTEN), port).start()
 
 
 def _schedule_jobs(corona_update_interval, corona_update_interval_function):
-    schedule.every(corona_update_interval).hours.do(corona_update_interval_function)
-    while 1:
-        schedule.run_pending()
-        time.sleep(60)
+    from update_scheduler import UpdateScheduler
+
+    # Checked often while RKI usually publishes, every corona_update_interval hours otherwise
+    UpdateScheduler(corona_update_interval * 60 * 60).run_forever(corona_update_interval_function)
+
+
+def _run_job(job, *args, **kwargs):
+    try:
+        job(*args, **kwargs)
+    except Exception:
+        # The next run may succeed, don't stop the scheduler
+        logger.exception("Job {} failed.".format(job.__name__))
 
 
 # Press the green button in the gutter to run the script.
@@ -0,0 +1,85 @@
+from fnmatch import fnmatchcase
+
+from storage import Storage
+
+
+class MemoryStorage(Storage):
+    """Keeps everything in dicts. Nothing is persisted, the data is lost when the process ends."""
+
+    def __init__(self):
+        super().__init__()
+        self._strings = {}
+        self._sets = {}
+        self._hashes = {}
+
+    def _containers(self):
+        return self._strings, self._sets, self._hashes
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(1 for key in keys if any(key in container for container in self._containers()))
+
+    def keys(self, pattern="*"):
+        with self.lock:
+            keys = set(self._strings) | set(self._sets) | set(self._hashes)
+        return [key for key in keys if fnmatchcase(key, pattern)]
+
+    def get(self, key):
+        return self._strings.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self._strings[key] = str(value)
+        return True
+
+    def mget(self, keys):
+        with self.lock:
+            return [self._strings.get(key) for key in keys]
+
+    def delete(self, *keys):
+        deleted = 0
+        with self.lock:
+            for key in keys:
+                removed = [container.pop(key, None) for container in self._containers()]
+                if any(value is not None for value in removed):
+                    deleted += 1
+        return deleted
+
+    def sadd(self, key, *values):
+        with self.lock:
+            members = self._sets.setdefault(key, set())
+            size = len(members)
+            members.update(str(value) for value in values)
+            return len(members) - size
+
+    def srem(self, key, *values):
+        with self.lock:
+            members = self._sets.get(key)
+            if members is None:
+                return 0
+            size = len(members)
+            members.difference_update(str(value) for value in values)
+            if len(members) == 0:
+                del self._sets[key]
+            return size - len(members)
+
+    def smembers(self, key):
+        with self.lock:
+            return set(self._sets.get(key, ()))
+
+    def scard(self, key):
+        return len(self._sets.get(key, ()))
+
+    def hget(self, name, key):
+        return self._hashes.get(name, {}).get(key)
+
+    def hset(self, name, key, value):
+        with self.lock:
+            values = self._hashes.setdefault(name, {})
+            added = 0 if key in values else 1
+            values[key] = str(value)
+            return added
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self._hashes.get(name, {}))
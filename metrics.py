@@ -0,0 +1,192 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LISTEN = "127.0.0.1"
+DEFAULT_PATH = "/metrics"
+
+# Seconds, from a fast storage operation up to a slow RKI download
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_metrics_lock = threading.Lock()
+
+
+class _Metric():
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def _check(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError("{} expects the labels {}, got {}".format(self.name, self.labels, label_values))
+
+    def _label_text(self, label_values, extra=()):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + "}"
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation), "# TYPE {} {}".format(self.name, self.type)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            lines.extend(self._render_value(label_values, value))
+        return lines
+
+    def _render_value(self, label_values, value):
+        return ["{}{} {}".format(self.name, self._label_text(label_values), _number(value))]
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        self._check(label_values)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, *label_values):
+        self._check(label_values)
+        with self._lock:
+            self._values[label_values] = value
+
+    def value(self, *label_values):
+        return self._values.get(label_values)
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        self._check(label_values)
+        # Upper bounds are inclusive (le), values above the last bound only count for +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # Count per bucket, then sum and count of all observations
+                counts = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def count(self, *label_values):
+        counts = self._values.get(label_values)
+        return counts[-1] if counts is not None else 0
+
+    def _render_value(self, label_values, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append("{}_bucket{} {}".format(self.name, self._label_text(label_values, [("le", _number(bound))]),
+                                                 cumulative))
+        lines.append("{}_sum{} {}".format(self.name, self._label_text(label_values), _number(counts[-2])))
+        lines.append("{}_count{} {}".format(self.name, self._label_text(label_values), counts[-1]))
+        return lines
+
+
+def render():
+    """Returns all metrics in the Prometheus text exposition format."""
+    with _metrics_lock:
+        metrics = list(_metrics)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def latency_percentiles(latencies):
+    """Returns the latency_p50 and latency_p99 of the latency samples for a stats() dict, None without samples."""
+    latencies = sorted(latencies)
+    return {
+        "latency_p50": latencies[len(latencies) // 2] if latencies else None,
+        "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else None,
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != self.server.path:
+            self._respond(404, b"", "text/plain")
+            return
+        self._respond(200, render().encode("utf-8"), _CONTENT_TYPE)
+
+    def _respond(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.client_address[0], format % args)
+
+
+class MetricsServer():
+    """Serves the metrics at GET <path> for Prometheus or curl, in a background thread."""
+
+    def __init__(self, listen=DEFAULT_LISTEN, port=0, path=DEFAULT_PATH):
+        self._httpd = ThreadingHTTPServer((listen, port), _MetricsRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.path = path
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, name="metrics-server", daemon=True).start()
+        logger.info("Serving metrics on {}:{}{}".format(self._httpd.server_address[0], self.port, self._httpd.path))
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
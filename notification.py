@@ -1,16 +1,61 @@
 import corona
+import outbox
 import telegram_bot
 import user
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Changes are enqueued by one thread at a time, so a resumed notification and a new update don't notify twice
+_notify_lock = threading.Lock()
 
-def notify_users():
-    user_ids = user.users()
-    for user_id in user_ids:
-        cities = user.all_cities(user_id)
-        info = corona.full_info(cities)
 
-        logger.debug("Notifying user: {}".format(user_id))
-        telegram_bot.send_message(user_id, info)
+def notify_users(changed_object_ids=None):
+    """Notifies the subscribers of the changed cities/areas about them, or all users about all of their cities.
+
+    The messages are stored in the outbox before they are sent, a restart doesn't lose or repeat them (see resume).
+    """
+    enqueue_notifications(changed_object_ids)
+
+    progress = outbox.drain(telegram_bot.broadcast)
+    logger.info("Notified users - {}".format(progress))
+
+
+def enqueue_notifications(changed_object_ids=None):
+    """Like notify_users, but only stores the messages in the outbox. Broadcast workers send them."""
+    with _notify_lock:
+        if changed_object_ids is not None:
+            # Changes notified in the meantime are skipped
+            changed_object_ids = frozenset(str(object_id) for object_id in changed_object_ids) & corona.unnotified()
+
+        # Users with the same subscriptions get the same message, so every distinct set of cities is rendered only once
+        subscriptions = user.load_subscriptions(changed_object_ids)
+        user_ids_by_cities = {frozenset(city_keys): user_ids for city_keys, user_ids in subscriptions.groups()}
+
+        logger.info("Notifying {} users with {} distinct subscriptions.".format(len(subscriptions),
+                                                                               len(user_ids_by_cities)))
+
+        # The messages and the notified changes are committed together
+        outbox_pipeline = outbox.pipeline()
+        if changed_object_ids is not None:
+            corona.mark_notified(outbox_pipeline, changed_object_ids)
+        outbox.enqueue(_messages(user_ids_by_cities), outbox_pipeline)
+
+
+def resume(send=True):
+    """Finishes what a restart interrupted: notifies about changes nobody was notified about and sends the pending
+    messages of the outbox. Without send, the messages are only enqueued."""
+    if send:
+        notify_users(corona.unnotified())
+    else:
+        enqueue_notifications(corona.unnotified())
+
+
+def _messages(user_ids_by_cities):
+    for city_keys, user_ids in user_ids_by_cities.items():
+        cities = [data for data in corona.get_datas(sorted(city_keys)) if data]
+        if len(cities) == 0:
+            continue
+
+        yield corona.full_info(cities), user_ids
@@ -0,0 +1,132 @@
+import logging
+import threading
+import uuid
+
+from telegram.error import Unauthorized
+
+import metrics
+import user
+from broadcast import is_retryable
+from redis_storage import RedisDB
+
+logger = logging.getLogger(__name__)
+
+# Stored next to the corona data, so the changes and their messages can be enqueued in one transaction
+_DATABSE_FILE = "corona.db"
+_redis_outbox = RedisDB(_DATABSE_FILE, "outbox")
+
+# Members "<chat_id> <message_id>", removed when the message was delivered (or can never be)
+_PENDING_KEY = "pending"
+# Ids of all stored message texts, a text is deleted as soon as nobody is waiting for it anymore
+_MESSAGES_KEY = "messages"
+# Chats which blocked the bot (Unauthorized), they were unsubscribed
+_DEAD_LETTER_KEY = "dead_letter"
+
+_BATCH_SIZE = 500
+
+# Only one drain at a time, otherwise a pending message could be sent twice
+_drain_lock = threading.Lock()
+
+_pending = metrics.Gauge("outbox_pending_messages", "Messages waiting in the outbox after the last drain.")
+_dead_letters = metrics.Counter("outbox_dead_letters_total", "Chats unsubscribed because they blocked the bot.")
+
+
+def pipeline():
+    return _redis_outbox.pipeline()
+
+
+def enqueue(messages, outbox_pipeline=None):
+    """Stores the (text, chat_ids) tuples of messages, each text once. Nothing is sent before it is stored.
+
+    Other commands queued on outbox_pipeline are committed in the same transaction.
+    """
+    if outbox_pipeline is None:
+        outbox_pipeline = pipeline()
+
+    count = 0
+    for text, chat_ids in messages:
+        message_id = uuid.uuid4().hex
+        outbox_pipeline.set(_message_key(message_id), text)
+        outbox_pipeline.sadd(_MESSAGES_KEY, message_id)
+        for chat_id in chat_ids:
+            outbox_pipeline.sadd(_PENDING_KEY, "{} {}".format(chat_id, message_id))
+            count += 1
+    outbox_pipeline.execute()
+    logger.info("Enqueued {} messages.".format(count))
+    return count
+
+
+def drain(broadcast, shard=0, shards=1):
+    """Sends all pending messages with broadcast(messages, delivery_callback) and acknowledges every delivery.
+
+    After a crash, calling it again sends only the messages which weren't acknowledged yet. Only the messages in flight
+    when the process died can be delivered twice. Messages which failed after all retries stay pending for the next
+    drain.
+
+    With shards > 1, only the messages to chats with chat_id % shards == shard are sent. Every shard must be drained
+    by one process only (see main.py -role broadcast).
+    """
+    with _drain_lock:
+        progress = broadcast(_pending_messages(shard, shards), _acknowledge)
+        _delete_delivered_texts()
+        _pending.set(_redis_outbox.scard(_PENDING_KEY))
+        return progress
+
+
+def dead_letters():
+    return _redis_outbox.smembers(_DEAD_LETTER_KEY)
+
+
+def _pending_messages(shard, shards):
+    members = [member for member in _redis_outbox.sscan(_PENDING_KEY)
+               if shards == 1 or int(member.split(" ", 1)[0]) % shards == shard]
+    texts = {}
+    for i in range(0, len(members), _BATCH_SIZE):
+        batch = [member.split(" ", 1) for member in members[i:i + _BATCH_SIZE]]
+
+        missing = list(set(message_id for _, message_id in batch if message_id not in texts))
+        texts.update(zip(missing, _redis_outbox.mget([_message_key(message_id) for message_id in missing])))
+
+        for (chat_id, message_id), member in zip(batch, members[i:i + _BATCH_SIZE]):
+            if texts[message_id] is None:
+                logger.warning("Dropping message {} to {}: the text is missing.".format(message_id, chat_id))
+                _redis_outbox.srem(_PENDING_KEY, member)
+                continue
+            yield int(chat_id), texts[message_id], member
+
+
+def _acknowledge(message, error):
+    chat_id, _, member = message
+    if error is None:
+        _redis_outbox.srem(_PENDING_KEY, member)
+    elif isinstance(error, Unauthorized):
+        logger.info("Unsubscribing {}, it blocked the bot.".format(chat_id))
+        outbox_pipeline = pipeline()
+        outbox_pipeline.srem(_PENDING_KEY, member)
+        outbox_pipeline.sadd(_DEAD_LETTER_KEY, chat_id)
+        outbox_pipeline.execute()
+        _dead_letters.inc()
+        user.delete(chat_id)
+    elif not is_retryable(error):
+        # Sending it again would fail the same way, e.g. BadRequest or ChatMigrated
+        logger.warning("Dropping message to {}: {}".format(chat_id, error))
+        _redis_outbox.srem(_PENDING_KEY, member)
+
+
+def _delete_delivered_texts():
+    # Messages first: a message enqueued in the meantime is either not among them or its recipients are pending
+    message_ids = _redis_outbox.smembers(_MESSAGES_KEY)
+    referenced = set(member.split(" ", 1)[1] for member in _redis_outbox.sscan(_PENDING_KEY))
+    delivered = [message_id for message_id in message_ids if message_id not in referenced]
+    if len(delivered) == 0:
+        return
+
+    outbox_pipeline = pipeline()
+    for message_id in delivered:
+        outbox_pipeline.delete(_message_key(message_id))
+        outbox_pipeline.srem(_MESSAGES_KEY, message_id)
+    outbox_pipeline.execute()
+
+
+def _message_key(message_id):
+    return "message:" + message_id
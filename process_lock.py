@@ -0,0 +1,50 @@
+import fcntl
+import logging
+import os
+
+from config import get_config
+
+logger = logging.getLogger(__name__)
+
+_LOCK_DIRECTORY = "locks"
+
+
+class ProcessLock():
+    """An exclusive lock between the processes of one host, e.g. to elect the one ingest worker.
+
+    It is an flock on <databaseDirectory>/locks/<name>.lock. The operating system releases it when the process ends,
+    however it ends, so a waiting process takes over right away.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._file = None
+
+    @property
+    def locked(self):
+        return self._file is not None
+
+    def acquire(self, blocking=False):
+        directory = os.path.join(get_config()["databaseDirectory"], _LOCK_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+
+        lock_file = open(os.path.join(directory, self.name + ".lock"), "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        # The pid of the holder, for humans looking at the lock file
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
@@ -1,95 +1,256 @@
-from redislite import Redis
 import logging
+import threading
+import time
+from functools import wraps
+
+import metrics
 from config import get_config
 
+BACKEND_REDISLITE = "redislite"
+BACKEND_SQLITE = "sqlite"
+BACKEND_MEMORY = "memory"
+BACKENDS = (BACKEND_REDISLITE, BACKEND_SQLITE, BACKEND_MEMORY)
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
 _redis_instances = {}
+_redis_instances_lock = threading.Lock()
+# Embedded redis-servers, they are shut down as soon as their redislite instance is garbage collected
+_redislite_servers = []
 
 logger = logging.getLogger(__name__)
 
+_operation_duration = metrics.Histogram("storage_operation_duration_seconds",
+                                        "Duration of RedisDB operations, a pipeline counts as one operation.",
+                                        ["operation"])
+
+
+# A storage_tracing.StorageTracer or None, configured with the first connection. Disabled, it costs one check.
+_tracer = None
+_tracer_configured = False
+
+
+def set_tracer(tracer):
+    global _tracer, _tracer_configured
+    _tracer = tracer
+    _tracer_configured = True
+
+
+def _configure_tracer():
+    # storageTraceSampleRate defaults to tracing everything if the debug log is enabled, like the former debug output
+    config = get_config()
+    sample_rate = config.get("storageTraceSampleRate", 1.0 if logger.isEnabledFor(logging.DEBUG) else 0.0)
+    slow_ms = config.get("storageSlowOperationMs")
+    if sample_rate > 0 or slow_ms is not None:
+        from storage_tracing import StorageTracer
+        set_tracer(StorageTracer(sample_rate, slow_ms))
+    else:
+        set_tracer(None)
+
+
+def _observed(method):
+    operation = method.__name__
+
+    @wraps(method)
+    def _method(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            return result
+        finally:
+            duration = time.perf_counter() - started
+            _operation_duration.observe(duration, operation)
+            if _tracer is not None:
+                _tracer.trace(self.namespace, operation, args, duration, result)
+
+    return _method
+
+
+def create_connection(backend, filename):
+    """Opens the database file with the given backend. All of them provide the API of storage.Storage."""
+    if backend == BACKEND_REDISLITE:
+        return _create_redislite_connection(filename)
+    elif backend == BACKEND_SQLITE:
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(filename)
+    elif backend == BACKEND_MEMORY:
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError("Unknown storage backend: {}. Use one of {}.".format(backend, ", ".join(BACKENDS)))
+
+
+def _create_redislite_connection(filename):
+    from redis import BlockingConnectionPool, Redis
+    from redis.connection import UnixDomainSocketConnection
+    from redislite import Redis as RedisLite
+
+    server = RedisLite(filename, decode_responses=True)
+    _redislite_servers.append(server)
+
+    # Threads of the dispatcher, the scheduler and the broadcast get connections of their own
+    pool = BlockingConnectionPool(connection_class=UnixDomainSocketConnection, path=server.socket_file,
+                                  **_pool_options())
+    return Redis(connection_pool=pool)
+
+
+def _create_external_connection(url):
+    from redis import BlockingConnectionPool, Redis
+
+    return Redis(connection_pool=BlockingConnectionPool.from_url(url, **_pool_options()))
+
+
+def _pool_options():
+    config = get_config()
+    return {
+        "max_connections": config.get("storagePoolSize", DEFAULT_POOL_SIZE),
+        "health_check_interval": config.get("storageHealthCheckInterval", DEFAULT_HEALTH_CHECK_INTERVAL),
+        "decode_responses": True,
+    }
+
 
 def _get_redis_instance(filename):
     import os
 
-    db_dir = get_config()["databaseDirectory"]
-    if not os.path.isdir(db_dir):
-        os.mkdir(db_dir)
+    config = get_config()
+    with _redis_instances_lock:
+        if not _tracer_configured:
+            _configure_tracer()
+        if config.get("redisUrl"):
+            # All namespaces live in the external redis, they don't collide
+            filename = config["redisUrl"]
+        elif config.get("sharedDatabase"):
+            # All namespaces share one database file (and one embedded server)
+            filename = config["sharedDatabase"]
 
-    filename = db_dir + "/" + filename
-    if filename not in _redis_instances:
-        _redis_instances[filename] = Redis(filename, decode_responses=True)
-    return _redis_instances[filename]
+        if filename not in _redis_instances:
+            if config.get("redisUrl"):
+                _redis_instances[filename] = _create_external_connection(filename)
+            else:
+                db_dir = config["databaseDirectory"]
+                os.makedirs(db_dir, exist_ok=True)
+                _redis_instances[filename] = create_connection(config.get("storageBackend", BACKEND_REDISLITE),
+                                                               db_dir + "/" + filename)
+        return _redis_instances[filename]
 
 
 class RedisDB():
-    def __init__(self, db_filename, namespace):
-        redis_connection = _get_redis_instance(db_filename)
-        self.redis_connection: Redis = redis_connection
+    def __init__(self, db_filename, namespace, redis_connection=None):
+        self.db_filename = db_filename
         self.namespace = namespace
+        self._redis_connection = redis_connection
+
+    @property
+    def redis_connection(self):
+        # Opened on first use, so importing a module doesn't start a database server
+        if self._redis_connection is None:
+            self._redis_connection = _get_redis_instance(self.db_filename)
+        return self._redis_connection
 
+    @_observed
     def exists(self, key):
-        result = self.redis_connection.exists(self._ns_key(key))
-        logger.debug("EXISTS: {} - {}".format(self._ns_key(key), result))
-        return result
+        return self.redis_connection.exists(self._ns_key(key))
 
+    @_observed
     def hexists(self, key, name):
-        result = self.redis_connection.hexists(name, self._ns_key(key))
-        logger.debug("EXISTS: {} | {} - {}".format(name, self._ns_key(key), result))
-        return result
+        return self.redis_connection.hexists(name, self._ns_key(key))
 
+    @_observed
     def keys(self):
-        result = self.redis_connection.keys()
-        logger.debug("KEYS: - {}".format(result))
-        return result
+        return self.redis_connection.keys()
 
+    def scan_keys(self, count=500):
+        # Incremental SCAN limited to this namespace, yields keys without namespace
+        for key in self.redis_connection.scan_iter(match=self.namespace + ":*", count=count):
+            yield self.remove_namespace(key)
+
+    @_observed
     def get(self, key):
-        result = self.redis_connection.get(self._ns_key(key))
-        logger.debug("GET: {} - {}".format(self._ns_key(key), result))
-        return result
+        return self.redis_connection.get(self._ns_key(key))
 
+    @_observed
     def hget(self, key, name):
-        result = self.redis_connection.hget(name, self._ns_key(key))
-        logger.debug("GET: {} | {} - {}".format(name, self._ns_key(key), result))
-        return result
+        return self.redis_connection.hget(name, self._ns_key(key))
 
+    @_observed
     def set(self, key, value):
-        result = self.redis_connection.set(self._ns_key(key), value)
-        logger.debug("SET: {} | {} - {}".format(self._ns_key(key), value, result))
-        return result
+        return self.redis_connection.set(self._ns_key(key), value)
+
+    @_observed
+    def append(self, key, value):
+        return self.redis_connection.append(self._ns_key(key), value)
 
+    @_observed
+    def getrange(self, key, start, end):
+        return self.redis_connection.getrange(self._ns_key(key), start, end)
+
+    @_observed
+    def strlen(self, key):
+        return self.redis_connection.strlen(self._ns_key(key))
+
+    @_observed
     def hset(self, key, value, name):
-        result = self.redis_connection.hset(name, self._ns_key(key), value)
-        logger.debug("HSET: {} | {} | {} - {}".format(name, self._ns_key(key), value, result))
-        return result
+        return self.redis_connection.hset(name, self._ns_key(key), value)
 
+    @_observed
     def hgetall(self, name):
-        result = self.redis_connection.hgetall(name)
-        logger.debug("HGETALL: {} - {}".format(name, result))
-        return result
+        return self.redis_connection.hgetall(name)
 
+    @_observed
     def delete(self, key):
-        result = self.redis_connection.delete(self._ns_key(key))
-        logger.debug("DEL: {} - {}".format(self._ns_key(key), result))
-        return result
+        return self.redis_connection.delete(self._ns_key(key))
 
+    @_observed
     def sadd(self, key, value):
-        result = self.redis_connection.sadd(self._ns_key(key), value)
-        logger.debug("SADD: {} | {} - {}".format(self._ns_key(key), value, result))
-        return result
+        return self.redis_connection.sadd(self._ns_key(key), value)
 
+    @_observed
     def srem(self, key, value):
-        result = self.redis_connection.srem(self._ns_key(key), value)
-        logger.debug("SREM: {} | {} - {}".format(self._ns_key(key), value, result))
-        return result
+        return self.redis_connection.srem(self._ns_key(key), value)
 
+    @_observed
     def smembers(self, key):
-        result = self.redis_connection.smembers(self._ns_key(key))
-        logger.debug("SMEMBERS: {} - {}".format(key, result))
-        return result
+        return self.redis_connection.smembers(self._ns_key(key))
+
+    @_observed
+    def scard(self, key):
+        return self.redis_connection.scard(self._ns_key(key))
+
+    def sscan(self, key, count=500):
+        # Incremental SSCAN, doesn't block the server for big sets like SMEMBERS
+        for member in self.redis_connection.sscan_iter(self._ns_key(key), count=count):
+            yield member
+
+    @_observed
+    def sunion(self, keys):
+        ns_keys = [self._ns_key(key) for key in keys]
+        if len(ns_keys) == 0:
+            return set()
+        return self.redis_connection.sunion(ns_keys)
+
+    @_observed
+    def mget(self, keys):
+        ns_keys = [self._ns_key(key) for key in keys]
+        if len(ns_keys) == 0:
+            return []
+        return self.redis_connection.mget(ns_keys)
+
+    @_observed
+    def mset(self, mapping):
+        if len(mapping) == 0:
+            return True
+        return self.redis_connection.mset({self._ns_key(key): value for key, value in mapping.items()})
+
+    def pipeline(self):
+        return RedisPipeline(self.redis_connection, self.namespace)
 
     def _ns_key(self, key):
-        if str(key).startswith(self.namespace + ":"):
-            return key
-        return "{}:{}".format(self.namespace, key)
+        return _ns_key(self.namespace, key)
+
+    def namespaced_key(self, key):
+        # The key as it is stored, the counterpart of remove_namespace
+        return self._ns_key(key)
 
     def remove_namespace(self, key):
         if str(key).startswith(self.namespace + ":"):
@@ -97,5 +258,75 @@ class RedisDB():
         return key
 
 
+class RedisPipeline():
+    """Queues namespaced commands and runs them as a single MULTI/EXEC transaction on execute()."""
+
+    def __init__(self, redis_connection, namespace, pipeline=None):
+        self.redis_connection = redis_connection
+        self.pipeline = pipeline if pipeline is not None else redis_connection.pipeline(transaction=True)
+        self.namespace = namespace
+
+    def namespaced(self, redis_db):
+        # Commands of another RedisDB can join the transaction as long as it shares the same database file.
+        if redis_db.redis_connection is not self.redis_connection:
+            raise ValueError("{} uses a different database than this pipeline.".format(redis_db.namespace))
+        return RedisPipeline(self.redis_connection, redis_db.namespace, self.pipeline)
+
+    def set(self, key, value):
+        self.pipeline.set(_ns_key(self.namespace, key), value)
+        return self
+
+    def incr(self, key):
+        self.pipeline.incr(_ns_key(self.namespace, key))
+        return self
+
+    def append(self, key, value):
+        self.pipeline.append(_ns_key(self.namespace, key), value)
+        return self
+
+    def getrange(self, key, start, end):
+        self.pipeline.getrange(_ns_key(self.namespace, key), start, end)
+        return self
+
+    def strlen(self, key):
+        self.pipeline.strlen(_ns_key(self.namespace, key))
+        return self
+
+    def delete(self, key):
+        self.pipeline.delete(_ns_key(self.namespace, key))
+        return self
+
+    def sadd(self, key, value):
+        self.pipeline.sadd(_ns_key(self.namespace, key), value)
+        return self
+
+    def srem(self, key, value):
+        self.pipeline.srem(_ns_key(self.namespace, key), value)
+        return self
+
+    def scard(self, key):
+        self.pipeline.scard(_ns_key(self.namespace, key))
+        return self
+
+    def smembers(self, key):
+        self.pipeline.smembers(_ns_key(self.namespace, key))
+        return self
+
+    def mset(self, mapping):
+        if len(mapping) > 0:
+            self.pipeline.mset({_ns_key(self.namespace, key): value for key, value in mapping.items()})
+        return self
+
+    @_observed
+    def execute(self):
+        return self.pipeline.execute()
+
+
+def _ns_key(namespace, key):
+    if str(key).startswith(namespace + ":"):
+        return key
+    return "{}:{}".format(namespace, key)
+
+
 def get_pure_db_key(key):
     return key.split(":")[-1]
@@ -0,0 +1,173 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from storage import Storage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS strings (key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sets (key TEXT NOT NULL, member TEXT NOT NULL, PRIMARY KEY (key, member)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hashes (name TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,
+                                   PRIMARY KEY (name, key)) WITHOUT ROWID;
+"""
+
+# SQLite limits the number of host parameters of a statement
+_MAX_PARAMETERS = 900
+
+
+class SQLiteStorage(Storage):
+    """Stores everything in one SQLite database in WAL mode. Runs in-process, no server is started.
+
+    All threads share one connection, guarded by the storage lock. A pipeline is executed in one transaction.
+    """
+
+    def __init__(self, filename):
+        super().__init__()
+        self._connection = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL can only lose the last transactions on power loss, never corrupts the database
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        self._in_transaction = threading.local()
+
+    def _execute(self, sql, parameters=()):
+        with self.lock:
+            return self._connection.execute(sql, parameters).rowcount
+
+    def _fetchone(self, sql, parameters=()):
+        with self.lock:
+            return self._connection.execute(sql, parameters).fetchone()
+
+    def _fetchall(self, sql, parameters=()):
+        with self.lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            if getattr(self._in_transaction, "active", False):
+                yield
+                return
+
+            # Only marked once BEGIN succeeded, e.g. a "database is locked" must not leave the flag set
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._in_transaction.active = True
+                yield
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            else:
+                self._connection.execute("COMMIT")
+            finally:
+                self._in_transaction.active = False
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(1 for key in keys if self._fetchone(
+                "SELECT EXISTS(SELECT 1 FROM strings WHERE key = ?) OR EXISTS(SELECT 1 FROM sets WHERE key = ?) "
+                "OR EXISTS(SELECT 1 FROM hashes WHERE name = ?)", (key, key, key))[0])
+
+    def keys(self, pattern="*"):
+        # Redis and SQLite GLOB patterns are the same for *, ? and [...]
+        rows = self._fetchall("SELECT key FROM strings WHERE key GLOB ?1 UNION SELECT key FROM sets WHERE key GLOB ?1 "
+                             "UNION SELECT name FROM hashes WHERE name GLOB ?1", (pattern,))
+        return [row[0] for row in rows]
+
+    def get(self, key):
+        row = self._fetchone("SELECT value FROM strings WHERE key = ?", (key,))
+        return row[0] if row is not None else None
+
+    def set(self, key, value):
+        self._execute("INSERT OR REPLACE INTO strings (key, value) VALUES (?, ?)", (key, str(value)))
+        return True
+
+    def mget(self, keys):
+        keys = list(keys)
+        values = {}
+        with self.lock:
+            for i in range(0, len(keys), _MAX_PARAMETERS):
+                chunk = keys[i:i + _MAX_PARAMETERS]
+                rows = self._fetchall("SELECT key, value FROM strings WHERE key IN ({})".format(
+                    ",".join("?" * len(chunk))), chunk)
+                values.update(rows)
+        return [values.get(key) for key in keys]
+
+    def mset(self, mapping):
+        with self.transaction():
+            self._connection.executemany("INSERT OR REPLACE INTO strings (key, value) VALUES (?, ?)",
+                                         [(key, str(value)) for key, value in mapping.items()])
+        return True
+
+    def incr(self, key, amount=1):
+        with self.transaction():
+            return super().incr(key, amount)
+
+    def append(self, key, value):
+        with self.transaction():
+            self._execute("INSERT INTO strings (key, value) VALUES (?1, ?2) "
+                          "ON CONFLICT (key) DO UPDATE SET value = value || ?2", (key, str(value)))
+            return self.strlen(key)
+
+    def getrange(self, key, start, end):
+        if start >= 0 and end >= 0:
+            # Only the requested part is read from the database
+            row = self._fetchone("SELECT substr(value, ?, ?) FROM strings WHERE key = ?",
+                                 (start + 1, max(0, end - start + 1), key))
+            return row[0] if row is not None else ""
+        return super().getrange(key, start, end)
+
+    def strlen(self, key):
+        row = self._fetchone("SELECT length(value) FROM strings WHERE key = ?", (key,))
+        return row[0] if row is not None else 0
+
+    def delete(self, *keys):
+        deleted = 0
+        with self.transaction():
+            for key in keys:
+                removed = self._execute("DELETE FROM strings WHERE key = ?", (key,))
+                removed += self._execute("DELETE FROM sets WHERE key = ?", (key,))
+                removed += self._execute("DELETE FROM hashes WHERE name = ?", (key,))
+                if removed > 0:
+                    deleted += 1
+        return deleted
+
+    def sadd(self, key, *values):
+        with self.transaction():
+            return sum(self._execute("INSERT OR IGNORE INTO sets (key, member) VALUES (?, ?)",
+                                     (key, str(value))) for value in values)
+
+    def srem(self, key, *values):
+        with self.transaction():
+            return sum(self._execute("DELETE FROM sets WHERE key = ? AND member = ?", (key, str(value)))
+                       for value in values)
+
+    def smembers(self, key):
+        return set(row[0] for row in self._fetchall("SELECT member FROM sets WHERE key = ?", (key,)))
+
+    def scard(self, key):
+        return self._fetchone("SELECT COUNT(*) FROM sets WHERE key = ?", (key,))[0]
+
+    def sunion(self, keys):
+        keys = list(keys)
+        result = set()
+        with self.lock:
+            for i in range(0, len(keys), _MAX_PARAMETERS):
+                chunk = keys[i:i + _MAX_PARAMETERS]
+                rows = self._fetchall("SELECT DISTINCT member FROM sets WHERE key IN ({})".format(
+                    ",".join("?" * len(chunk))), chunk)
+                result.update(row[0] for row in rows)
+        return result
+
+    def hget(self, name, key):
+        row = self._fetchone("SELECT value FROM hashes WHERE name = ? AND key = ?", (name, key))
+        return row[0] if row is not None else None
+
+    def hset(self, name, key, value):
+        with self.transaction():
+            added = 0 if self.hexists(name, key) else 1
+            self._execute("INSERT OR REPLACE INTO hashes (name, key, value) VALUES (?, ?, ?)", (name, key, str(value)))
+            return added
+
+    def hgetall(self, name):
+        return dict(self._fetchall("SELECT key, value FROM hashes WHERE name = ?", (name,)))
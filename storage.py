@@ -0,0 +1,132 @@
+import threading
+
+
+class Storage():
+    """The subset of the redis-py client API used by RedisDB, values are str like with decode_responses=True.
+
+    redislite.Redis provides it as is. Other backends implement it, RedisDB works with all of them the same way.
+    """
+
+    def __init__(self):
+        # Held while a pipeline is executed, so its commands are applied atomically
+        self.lock = threading.RLock()
+
+    def exists(self, *keys):
+        raise NotImplementedError()
+
+    def keys(self, pattern="*"):
+        raise NotImplementedError()
+
+    def scan_iter(self, match=None, count=None):
+        yield from self.keys(match or "*")
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value):
+        raise NotImplementedError()
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def mset(self, mapping):
+        with self.lock:
+            for key, value in mapping.items():
+                self.set(key, value)
+        return True
+
+    def incr(self, key, amount=1):
+        with self.lock:
+            value = int(self.get(key) or 0) + amount
+            self.set(key, value)
+            return value
+
+    def append(self, key, value):
+        with self.lock:
+            value = (self.get(key) or "") + str(value)
+            self.set(key, value)
+            return len(value)
+
+    def getrange(self, key, start, end):
+        return _getrange(self.get(key) or "", start, end)
+
+    def strlen(self, key):
+        return len(self.get(key) or "")
+
+    def delete(self, *keys):
+        raise NotImplementedError()
+
+    def sadd(self, key, *values):
+        raise NotImplementedError()
+
+    def srem(self, key, *values):
+        raise NotImplementedError()
+
+    def smembers(self, key):
+        raise NotImplementedError()
+
+    def scard(self, key):
+        return len(self.smembers(key))
+
+    def sscan_iter(self, key, match=None, count=None):
+        yield from self.smembers(key)
+
+    def sunion(self, keys):
+        result = set()
+        for key in keys:
+            result |= self.smembers(key)
+        return result
+
+    def hexists(self, name, key):
+        return self.hget(name, key) is not None
+
+    def hget(self, name, key):
+        raise NotImplementedError()
+
+    def hset(self, name, key, value):
+        raise NotImplementedError()
+
+    def hgetall(self, name):
+        raise NotImplementedError()
+
+    def pipeline(self, transaction=True):
+        return Pipeline(self)
+
+    def transaction(self):
+        # Context manager wrapping the execution of a pipeline, backends can add e.g. a database transaction
+        return self.lock
+
+
+class Pipeline():
+    """Queues commands and applies all of them at once on execute(), holding the storage's transaction."""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._storage, name)
+
+        def _queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+
+        return _queue
+
+    def __len__(self):
+        return len(self._commands)
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        with self._storage.transaction():
+            return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+def _getrange(value, start, end):
+    # Like redis' GETRANGE: both offsets are inclusive, negative offsets count from the end
+    length = len(value)
+    if start < 0:
+        start = max(0, length + start)
+    if end < 0:
+        end = length + end
+    return value[start:end + 1]
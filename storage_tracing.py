@@ -0,0 +1,49 @@
+import logging
+import random
+
+logger = logging.getLogger("redis_storage.trace")
+
+# Longer arguments and results are summarized, a traced MGET of 400 keys doesn't write 400 keys to the log
+_MAX_VALUE_LENGTH = 80
+
+
+class StorageTracer():
+    """Logs storage operations: all operations slower than slow_ms and a random sample (sample_rate) of the others.
+
+    Everything is evaluated only for operations that are actually logged. The records carry the operation, namespace,
+    duration_ms and the summarized args/result as extra attributes for structured log handlers.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_ms=None, level=logging.DEBUG, slow_level=logging.WARNING):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.level = level
+        self.slow_level = slow_level
+        self._random = random.random
+
+    def trace(self, namespace, operation, args, duration, result):
+        duration_ms = duration * 1000
+        if self.slow_ms is not None and duration_ms >= self.slow_ms:
+            level = self.slow_level
+        elif self.sample_rate > 0 and (self.sample_rate >= 1 or self._random() < self.sample_rate):
+            level = self.level
+        else:
+            return
+        if not logger.isEnabledFor(level):
+            return
+
+        args = ", ".join(describe(arg) for arg in args)
+        result = describe(result)
+        logger.log(level, "%s %s(%s) %.3f ms -> %s", namespace, operation.upper(), args, duration_ms, result,
+                   extra={"operation": operation, "namespace": namespace, "duration_ms": duration_ms,
+                          "arguments": args, "result": result})
+
+
+def describe(value):
+    if isinstance(value, (list, tuple, set, frozenset, dict)):
+        if len(value) > 3:
+            return "<{} {} items>".format(type(value).__name__, len(value))
+    text = repr(value)
+    if len(text) > _MAX_VALUE_LENGTH:
+        return "{}...<{} chars>".format(text[:_MAX_VALUE_LENGTH], len(text))
+    return text
@@ -0,0 +1,66 @@
+from array import array
+from bisect import bisect_left
+
+# Positions of the cities/areas are stored as uint16, there are about 400
+_MAX_CITIES = 1 << 16
+
+
+class Subscriptions():
+    """The subscriptions of many users, packed into three arrays instead of a set per user.
+
+    user_ids holds the sorted user ids, the cities of user_ids[i] are cities[offsets[i]:offsets[i + 1]], sorted
+    positions in city_keys. A user with two subscriptions takes 8 + 4 + 2 * 2 bytes.
+    """
+
+    def __init__(self, city_keys, user_ids, offsets, cities):
+        self.city_keys = city_keys
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.cities = cities
+
+    @classmethod
+    def from_subscribers(cls, city_keys, subscribers):
+        """Builds the table from the subscribers (user ids) of each of the city_keys."""
+        if len(city_keys) > _MAX_CITIES:
+            raise ValueError("Too many cities/areas: {}".format(len(city_keys)))
+
+        # One int per subscription, sorted by user and then city
+        pairs = sorted(int(user_id) * _MAX_CITIES + position
+                       for position, user_ids in enumerate(subscribers) for user_id in user_ids)
+
+        user_ids = array("q")
+        offsets = array("I")
+        cities = array("H")
+        for pair in pairs:
+            user_id, position = divmod(pair, _MAX_CITIES)
+            if len(user_ids) == 0 or user_ids[-1] != user_id:
+                user_ids.append(user_id)
+                offsets.append(len(cities))
+            cities.append(position)
+        offsets.append(len(cities))
+        return cls(list(city_keys), user_ids, offsets, cities)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def city_keys_of(self, user_id):
+        i = bisect_left(self.user_ids, user_id)
+        if i == len(self.user_ids) or self.user_ids[i] != user_id:
+            return []
+        return [self.city_keys[position] for position in self.cities[self.offsets[i]:self.offsets[i + 1]]]
+
+    def groups(self):
+        """Yields (city_keys, user_ids) for every distinct set of cities, with all users subscribed to exactly it."""
+        user_ids_by_cities = {}
+        offsets = self.offsets
+        for i, user_id in enumerate(self.user_ids):
+            user_ids_by_cities.setdefault(self.cities[offsets[i]:offsets[i + 1]].tobytes(), []).append(user_id)
+
+        for packed, user_ids in user_ids_by_cities.items():
+            positions = array("H")
+            positions.frombytes(packed)
+            yield [self.city_keys[position] for position in positions], user_ids
+
+    @property
+    def nbytes(self):
+        return sum(len(values) * values.itemsize for values in (self.user_ids, self.offsets, self.cities))
@@ -1,17 +1,42 @@
 import logging
+import math
+import time
 
 from telegram.error import Unauthorized, TimedOut
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
 from telegram import ParseMode
 
 import corona
+import metrics
 import user
+from broadcast import Broadcaster, DEFAULT_WORKERS, GLOBAL_MESSAGES_PER_SECOND
+from cache import SingleFlight, VersionedCache
+from city_search import normalize
 from config import get_config
 
 logger = logging.getLogger(__name__)
 
 _updater: Updater
 
+_command_duration = metrics.Histogram("bot_command_duration_seconds", "Duration of handling a command.", ["command"])
+_command_errors = metrics.Counter("bot_command_errors_total", "Commands that failed with an exception.", ["command"])
+_response_cache = metrics.Counter("bot_response_cache_total", "Lookups of cached replies by command and result.",
+                                  ["command", "result"])
+
+DEFAULT_RESPONSE_CACHE_SIZE = 1000
+
+# Replies of the current dataset version, keyed by the normalized search query and by the set of subscriptions
+_search_responses = VersionedCache()
+_info_responses = VersionedCache()
+# Identical requests arriving at the same time, e.g. right after an update, are answered with one computation
+_single_flight = SingleFlight()
+
+_NO_CITIES = "No cities or areas are added yet."
+
+DEFAULT_TOP_COUNT = 10
+# Longer lists don't fit into one message
+_MAX_LISTED_COUNTIES = 50
+
 
 def _invalid(update, context):
     reply_text = "Sorry, I don't understand.\n"
@@ -43,6 +68,21 @@ def _help(update, context):
     reply_text += "Example: /info"
     reply_text += "\n\n"
 
+    reply_text += "/top [<number>]\n"
+    reply_text += "Lists the cities and areas with the highest incidence value (default 10).\n"
+    reply_text += "Example: /top 20"
+    reply_text += "\n\n"
+
+    reply_text += "/above <incidence>\n"
+    reply_text += "Lists the cities and areas with an incidence value above the given one.\n"
+    reply_text += "Example: /above 200"
+    reply_text += "\n\n"
+
+    reply_text += "/state [<name>]\n"
+    reply_text += "Lists the states by their incidence value, or shows the statistics of the given state.\n"
+    reply_text += "Example: /state Bayern"
+    reply_text += "\n\n"
+
     reply_text += "/remove <ID>\n"
     reply_text += "Removes a city or an area from the subscriptions by using the corresponding ID.\n"
     reply_text += "Example: /remove 224"
@@ -85,15 +125,12 @@ def _search(update, context):
 
     search_city = " ".join(context.args)
 
-    found_cities = corona.find_city(search_city)
-    if len(found_cities) == 0:
-        update.message.reply_text("No cities or areas found for '{}'".format(found_cities))
+    cities_formatted = _cached_response("search", _search_responses, normalize(search_city),
+                                        lambda: _search_results(search_city))
+    if len(cities_formatted) == 0:
+        update.message.reply_text("No cities or areas found for '{}'".format(search_city))
         return
 
-    found_cities.sort(key=lambda d: d[corona.C_CITY_AREA])
-
-    cities_formatted = "\n".join([corona.short_city_info(data) for data in found_cities])
-
     reply_text = "Cities and areas found:\n" \
                  "\n" \
                  "{}\n" \
@@ -103,6 +140,11 @@ def _search(update, context):
     update.message.reply_html(reply_text)
 
 
+def _search_results(search_city):
+    # Cities are ranked by relevance, best match first
+    return "\n".join([corona.short_city_info(data) for data in corona.find_city(search_city)])
+
+
 def remove(update, context):
     if len(context.args) == 0:
         update.message.reply_text(
@@ -153,41 +195,213 @@ def _add(update, context):
 
 def _info(update, context):
     chat_id = update.message.chat_id
-    cities = user.all_cities(chat_id)
+    city_keys = user.city_keys(chat_id)
 
-    if len(cities) == 0:
-        reply_html = "No cities or areas are added yet."
+    if len(city_keys) == 0:
+        reply_html = _NO_CITIES
     else:
-        reply_html = corona.full_info(cities)
+        reply_html = _cached_response("info", _info_responses, frozenset(city_keys), lambda: _info_reply(city_keys))
 
     update.message.reply_html(reply_html)
 
 
+def _info_reply(city_keys):
+    cities = [data for data in corona.get_datas(city_keys) if data]
+    return corona.full_info(cities) if len(cities) > 0 else _NO_CITIES
+
+
+def _top(update, context):
+    count = DEFAULT_TOP_COUNT
+    if len(context.args) > 0:
+        try:
+            count = int(context.args[0])
+        except ValueError:
+            count = 0
+        if not 0 < count <= _MAX_LISTED_COUNTIES:
+            update.message.reply_text("Please enter a number from 1 to {}. E.g.: /top 20".format(_MAX_LISTED_COUNTIES))
+            return
+
+    table = _county_table(update)
+    if table is None:
+        return
+    reply_text = "<u>Highest incidence</u> - cases last 7 days per 100k:\n{}\n\n{}".format(
+        _county_list(table.top(count)), _percentiles_info(table))
+    update.message.reply_html(reply_text)
+
+
+def _above(update, context):
+    try:
+        threshold = float(context.args[0].replace(",", "."))
+    except (IndexError, ValueError):
+        threshold = None
+    if threshold is None or not math.isfinite(threshold):
+        update.message.reply_text("Please enter an incidence value. E.g.: /above 200")
+        return
+
+    table = _county_table(update)
+    if table is None:
+        return
+    count = table.count_above(threshold)
+    if count == 0:
+        update.message.reply_text("No cities or areas have an incidence value above {:g}.".format(threshold))
+        return
+
+    reply_text = "<b>{}</b> of {} cities and areas have an incidence value above {:g}:\n{}".format(
+        count, len(table), threshold, _county_list(table.above(threshold, _MAX_LISTED_COUNTIES)))
+    if count > _MAX_LISTED_COUNTIES:
+        reply_text += "\n..."
+    update.message.reply_html(reply_text)
+
+
+def _state(update, context):
+    table = _county_table(update)
+    if table is None:
+        return
+    if len(context.args) == 0:
+        rows = ["{}. {}: <b>{:.2f}</b> ({} cities/areas)".format(i, stats.name, stats.cases7_per_100k, stats.counties)
+                for i, stats in enumerate(table.state_ranking, start=1)]
+        update.message.reply_html("<u>States</u> - cases last 7 days per 100k:\n" + "\n".join(rows))
+        return
+
+    name = " ".join(context.args)
+    stats = table.state(name)
+    if stats is None:
+        update.message.reply_text("No state found for '{}'. Use /state to list all states.".format(name))
+        return
+
+    reply_text = "<u>{}</u>\n" \
+                 "\tCases last 7 days per 100k: <b>{:.2f}</b>\n" \
+                 "\tCases: {}\n" \
+                 "\tCities/Areas: {}, incidence from {:.2f} to {:.2f}, median {:.2f}\n" \
+                 "\n" \
+                 "Highest incidence:\n" \
+                 "{}".format(stats.name, stats.cases7_per_100k, stats.cases, stats.counties, stats.minimum,
+                             stats.maximum, stats.median,
+                             _county_list(table.state_counties(stats, DEFAULT_TOP_COUNT)))
+    update.message.reply_html(reply_text)
+
+
+def _county_table(update):
+    table = corona.county_table()
+    if len(table) == 0:
+        update.message.reply_text("No data available yet, please try again later.")
+        return None
+    return table
+
+
+def _county_list(counties):
+    return "\n".join("{:.2f} - ID: <b>{}</b> - {} ({})".format(county.cases7_per_100k, county.object_id, county.name,
+                                                              county.description)
+                     for county in counties)
+
+
+def _percentiles_info(table):
+    return "All {} cities/areas: {}".format(len(table), ", ".join(
+        "{}% up to {:.2f}".format(percentile, value) for percentile, value in table.percentiles.items()))
+
+
+def _cached_response(command, cache, key, render):
+    version = corona.dataset_version()
+    if cache.version is None or version > cache.version:
+        if cache.version is None:
+            cache.maxsize = get_config().get("responseCacheSize", DEFAULT_RESPONSE_CACHE_SIZE)
+        cache.invalidate(version)
+
+    response = cache.get(key)
+    if response is not None:
+        _response_cache.inc(command, "hit")
+        return response
+
+    _response_cache.inc(command, "miss")
+    response = _single_flight.do((command, key, version), render)
+    cache.put(key, response, version)
+    return response
+
+
 def send_message(chat_id, message):
     if _updater:
         try:
             _updater.bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.HTML)
         except (Unauthorized, TimedOut) as e:
-            print("{}: {}".format(chat_id, str(e)))
+            logger.warning("Sending message to {} failed: {}".format(chat_id, e))
+    else:
+        raise NotImplementedError("Initialize this module first!")
+
+
+def broadcast(messages, delivery_callback=None, rate=None):
+    if _updater:
+        broadcaster = Broadcaster(_updater.bot,
+                                  workers=get_config().get("broadcastWorkers", DEFAULT_WORKERS),
+                                  rate=rate or get_config().get("broadcastMessagesPerSecond",
+                                                                GLOBAL_MESSAGES_PER_SECOND),
+                                  delivery_callback=delivery_callback)
+        return broadcaster.broadcast(messages)
     else:
         raise NotImplementedError("Initialize this module first!")
 
 
 def init():
     global _updater
-    _updater = Updater(get_config()["telegramToken"], use_context=True)
+    _updater = Updater(get_config()["telegramToken"], base_url=get_config().get("telegramApiUrl"), use_context=True)
 
     dp = _updater.dispatcher
-    dp.add_handler(CommandHandler("start", _start, filters=~Filters.update.edited_message))
-    dp.add_handler(CommandHandler("delete", _delete, filters=~Filters.update.edited_message))
-    dp.add_handler(CommandHandler("help", _help, filters=~Filters.update.edited_message))
-    dp.add_handler(CommandHandler("search", _search, filters=~Filters.update.edited_message))
-    dp.add_handler(CommandHandler("info", _info, filters=~Filters.update.edited_message))
-    dp.add_handler(CommandHandler("sub", _add, filters=~Filters.update.edited_message))
-    dp.add_handler(CommandHandler("remove", remove, filters=~Filters.update.edited_message))
-    dp.add_handler(MessageHandler(Filters.text & ~Filters.update.edited_message, _invalid))
+    for command, callback in (("start", _start), ("delete", _delete), ("help", _help), ("search", _search),
+                              ("info", _info), ("sub", _add), ("remove", remove), ("top", _top), ("above", _above),
+                              ("state", _state)):
+        dp.add_handler(CommandHandler(command, _observed(command, callback), filters=~Filters.update.edited_message))
+    dp.add_handler(MessageHandler(Filters.text & ~Filters.update.edited_message, _observed("invalid", _invalid)))
+
+
+def _observed(command, callback):
+    def _callback(update, context):
+        started = time.perf_counter()
+        try:
+            return callback(update, context)
+        except Exception:
+            _command_errors.inc(command)
+            raise
+        finally:
+            _command_duration.observe(time.perf_counter() - started, command)
+
+    return _callback
 
 
 def poll():
     _updater.start_polling()
     _updater.idle()
+
+
+def serve_webhook():
+    import threading
+    from urllib.parse import urlparse
+
+    import webhook
+
+    config = get_config()
+    url = config["webhookUrl"]
+    secret_token = config.get("webhookSecret")
+    if not secret_token:
+        raise ValueError("webhookSecret is required with the webhook update mode.")
+
+    server = webhook.WebhookServer(_updater.bot, _updater.dispatcher,
+                                   listen=config.get("webhookListen", webhook.DEFAULT_LISTEN),
+                                   port=config.get("webhookPort", webhook.DEFAULT_PORT),
+                                   path=urlparse(url).path or webhook.DEFAULT_PATH,
+                                   secret_token=secret_token,
+                                   queue_size=config.get("webhookQueueSize", webhook.DEFAULT_QUEUE_SIZE),
+                                   workers=config.get("webhookWorkers", webhook.DEFAULT_WORKERS))
+    server.start()
+    _updater.bot.set_webhook(url=url, api_kwargs={"secret_token": secret_token})
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+def poll_async(corona_update_interval):
+    from async_runtime import AsyncRuntime, DEFAULT_COMMAND_WORKERS
+
+    runtime = AsyncRuntime(_updater.bot, _updater.dispatcher, corona_update_interval,
+                           command_workers=get_config().get("commandWorkers", DEFAULT_COMMAND_WORKERS))
+    runtime.run()
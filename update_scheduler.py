@@ -0,0 +1,165 @@
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from config import get_config
+from redis_storage import RedisDB
+
+logger = logging.getLogger(__name__)
+
+_DATABSE_FILE = "corona.db"
+_redis_scheduler = RedisDB(_DATABSE_FILE, "scheduler")
+
+# Minutes of the day new data was found at, the most recent last
+_PUBLICATIONS_KEY = "publications"
+_MAX_PUBLICATIONS = 14
+# Fewer publications don't make a window, the data is checked every _LEARNING_INTERVAL until then
+_MIN_PUBLICATIONS = 3
+_LEARNING_INTERVAL = 10 * 60
+# A publication is only remembered if it is known this precisely, e.g. not after the bot was down for a day
+_MAX_OBSERVATION_SPAN = 90 * 60
+
+DEFAULT_POLL_INTERVAL = 60
+DEFAULT_WINDOW_MARGIN = 15
+# After RKI published, the data is checked this often until the next window, in case of corrections
+_CORRECTION_INTERVAL = 6 * 60 * 60
+_JITTER = 0.2
+
+_DAY_MINUTES = 24 * 60
+
+_next_run = metrics.Gauge("update_next_run_timestamp_seconds", "Unix time of the next planned update check.")
+_publication_latency = metrics.Histogram(
+    "update_publication_latency_seconds",
+    "Time from the last check which still found the old data until the new data was stored and notified.",
+    buckets=(10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, 43200, 86400))
+
+
+def publication_window(minutes, margin):
+    """Returns (first minute, length in minutes) of the shortest time of day range containing all minutes, widened by
+    margin minutes on both sides. None if there are too few minutes or the window would cover the whole day."""
+    if len(minutes) < _MIN_PUBLICATIONS:
+        return None
+
+    # The window is the day without the longest gap between two publications, which can span midnight
+    ordered = sorted(set(minutes))
+    gaps = [((ordered[(i + 1) % len(ordered)] - minute) % _DAY_MINUTES or _DAY_MINUTES, i)
+            for i, minute in enumerate(ordered)]
+    gap, i = max(gaps)
+    length = _DAY_MINUTES - gap + 2 * margin
+    if length >= _DAY_MINUTES:
+        return None
+    return (ordered[(i + 1) % len(ordered)] - margin) % _DAY_MINUTES, length
+
+
+class UpdateScheduler():
+    """Plans the update checks around the time of the day RKI usually publishes.
+
+    The times new data was found at are remembered. Inside the window around them the data is checked every
+    updatePollInterval seconds (jittered), until the new data was found. Then it is only checked every few hours until
+    the next window opens. If RKI is late, the checks back off from updatePollInterval to idle_interval, which is
+    also the interval until enough publications were seen. Failed checks are retried with an exponential backoff.
+
+    RKI's last_update only carries the day, so the publication times are learned from when the new data was found.
+    """
+
+    def __init__(self, idle_interval, clock=time.time):
+        self.idle_interval = idle_interval
+        self.poll_interval = get_config().get("updatePollInterval", DEFAULT_POLL_INTERVAL)
+        self.margin = get_config().get("updateWindowMargin", DEFAULT_WINDOW_MARGIN)
+        self._clock = clock
+        self._random = random.Random()
+        self._publications = None
+        self._last_unchanged = None
+        self._found_at = None
+        self._failures = 0
+        # The first check runs right away
+        self.next_run = clock()
+
+    def delay(self):
+        return max(0.0, self.next_run - self._clock())
+
+    def window(self):
+        if self._publications is None:
+            self._publications = json.loads(_redis_scheduler.get(_PUBLICATIONS_KEY) or "[]")
+        return publication_window(self._publications, self.margin)
+
+    def run_forever(self, check):
+        """Calls check, which returns the number of updated cities/areas, whenever it is planned."""
+        while True:
+            time.sleep(self.delay())
+            try:
+                self.checked(check())
+            except Exception:
+                # The next run may succeed, don't stop the scheduler
+                logger.exception("Corona update failed.")
+                self.checked(failed=True)
+
+    def checked(self, updated=0, failed=False):
+        """Plans the next check after a check which updated updated cities/areas or failed."""
+        now = self._clock()
+        if failed:
+            self._failures += 1
+        else:
+            self._failures = 0
+            if updated:
+                self._found(now)
+            else:
+                self._last_unchanged = now
+
+        self.next_run = now + self._interval(now)
+        _next_run.set(self.next_run)
+        logger.info("Next update check at {}.".format(datetime.fromtimestamp(self.next_run).strftime("%H:%M:%S")))
+
+    def _found(self, now):
+        if self._last_unchanged is not None:
+            _publication_latency.observe(now - self._last_unchanged)
+            if now - self._last_unchanged <= _MAX_OBSERVATION_SPAN:
+                # Published somewhen between the last check and this one
+                self._remember(_minute_of_day((self._last_unchanged + now) / 2))
+        self._found_at = now
+
+    def _remember(self, minute):
+        self.window()
+        self._publications = (self._publications + [minute])[-_MAX_PUBLICATIONS:]
+        _redis_scheduler.set(_PUBLICATIONS_KEY, json.dumps(self._publications))
+
+    def _interval(self, now):
+        if self._failures > 0:
+            return self._jittered(min(self.idle_interval, self.poll_interval * 2 ** self._failures))
+
+        window = self.window()
+        if window is None:
+            return self._jittered(min(self.idle_interval, _LEARNING_INTERVAL))
+
+        opened = _window_start(now, window[0])
+        closed = opened + window[1] * 60
+        if self._found_at is None or self._found_at < opened:
+            if now < closed:
+                # Inside the window and RKI didn't publish yet
+                return self._jittered(self.poll_interval)
+            # RKI is late, checked less and less often
+            return self._jittered(min(self.idle_interval, max(self.poll_interval, (now - closed) / 2)))
+        # Published already, only corrections are looked for until the next window opens
+        return min(_window_start(now, window[0], following=True) - now, max(self.idle_interval, _CORRECTION_INTERVAL))
+
+    def _jittered(self, interval):
+        return interval * self._random.uniform(1 - _JITTER, 1 + _JITTER)
+
+
+def _minute_of_day(timestamp):
+    moment = datetime.fromtimestamp(timestamp)
+    return moment.hour * 60 + moment.minute
+
+
+def _window_start(timestamp, minute, following=False):
+    # The last time the window opened before timestamp, or the next time after it
+    moment = datetime.fromtimestamp(timestamp)
+    start = moment.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+    if start > moment:
+        start -= timedelta(days=1)
+    if following:
+        start += timedelta(days=1)
+    return start.timestamp()
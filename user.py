@@ -1,42 +1,134 @@
 import logging
+import threading
 
 import corona
 from redis_storage import RedisDB
+from subscriptions import Subscriptions
 
 logger = logging.getLogger(__name__)
 
 _DATABSE_FILE = "user.db"
 _redis_user_city = RedisDB(_DATABSE_FILE, "user_city")
+# Index of all users with subscriptions and, per city/area, of its subscribers
+_redis_subscribers = RedisDB(_DATABSE_FILE, "subscribers")
+_redis_city_subscribers = RedisDB(_DATABSE_FILE, "city_subscribers")
+
+_SUBSCRIBERS_KEY = "all"
+_INDEXED_KEY = "indexed"
+
+_index_checked = False
+_index_lock = threading.Lock()
+
+
+def _ensure_index():
+    # Databases created before the index existed are indexed once, using SCAN instead of KEYS
+    global _index_checked
+
+    if not _index_checked:
+        with _index_lock:
+            if not _index_checked:
+                if not _redis_subscribers.exists(_INDEXED_KEY):
+                    _rebuild_index()
+                _index_checked = True
+
+
+def _rebuild_index():
+    user_ids = list(_redis_user_city.scan_keys())
+
+    pipeline = _redis_user_city.pipeline()
+    for user_id in user_ids:
+        pipeline.smembers(user_id)
+    all_city_keys = pipeline.execute()
+
+    pipeline = _redis_subscribers.pipeline()
+    city_subscribers_pipeline = pipeline.namespaced(_redis_city_subscribers)
+    for user_id, city_keys in zip(user_ids, all_city_keys):
+        pipeline.sadd(_SUBSCRIBERS_KEY, user_id)
+        for city_key in city_keys:
+            city_subscribers_pipeline.sadd(city_key, user_id)
+    pipeline.set(_INDEXED_KEY, 1)
+    pipeline.execute()
+
+    logger.info("Indexed subscriptions of {} users.".format(len(user_ids)))
 
 
 def add_city(city_key, user_id):
     if corona.exists(city_key):
-        _redis_user_city.sadd(user_id, city_key)
+        _ensure_index()
+
+        pipeline = _redis_user_city.pipeline()
+        pipeline.sadd(user_id, city_key)
+        pipeline.namespaced(_redis_subscribers).sadd(_SUBSCRIBERS_KEY, user_id)
+        pipeline.namespaced(_redis_city_subscribers).sadd(city_key, user_id)
+        pipeline.execute()
         return True
     else:
         return False
 
 
 def users(plain_keys=True):
+    _ensure_index()
+
+    user_ids = _redis_subscribers.smembers(_SUBSCRIBERS_KEY)
     if plain_keys:
-        return [_redis_user_city.remove_namespace(key) for key in _redis_user_city.keys()]
-    return _redis_user_city.keys()
+        return list(user_ids)
+    return [_redis_user_city.namespaced_key(user_id) for user_id in user_ids]
+
+
+def load_subscriptions(city_keys=None):
+    """Loads the subscriptions to city_keys, all cities/areas by default, into a compact Subscriptions table.
+
+    The subscribers of all cities/areas are read in one pipelined round-trip, there are only about 400 of them. For
+    the changed cities/areas, each user gets exactly the changed cities/areas they follow.
+    """
+    _ensure_index()
+
+    if city_keys is None:
+        city_keys = _redis_city_subscribers.scan_keys()
+    city_keys = sorted(str(city_key) for city_key in city_keys)
+
+    pipeline = _redis_city_subscribers.pipeline()
+    for city_key in city_keys:
+        pipeline.smembers(city_key)
+    return Subscriptions.from_subscribers(city_keys, pipeline.execute())
 
 
 def remove_city(city_key, user_id):
-    return _redis_user_city.srem(user_id, city_key)
+    _ensure_index()
+
+    pipeline = _redis_user_city.pipeline()
+    pipeline.srem(user_id, city_key)
+    pipeline.scard(user_id)
+    pipeline.namespaced(_redis_city_subscribers).srem(city_key, user_id)
+    removed, remaining, _ = pipeline.execute()
+
+    if remaining == 0:
+        _redis_subscribers.srem(_SUBSCRIBERS_KEY, user_id)
+        # A city added concurrently (between SCARD and SREM) must not drop the user from the index
+        if _redis_user_city.scard(user_id) > 0:
+            _redis_subscribers.sadd(_SUBSCRIBERS_KEY, user_id)
+    return removed
 
 
 def delete(user_id):
-    return _redis_user_city.delete(user_id)
+    _ensure_index()
+
+    city_keys = _redis_user_city.smembers(user_id)
+
+    pipeline = _redis_user_city.pipeline()
+    pipeline.delete(user_id)
+    pipeline.namespaced(_redis_subscribers).srem(_SUBSCRIBERS_KEY, user_id)
+    city_subscribers_pipeline = pipeline.namespaced(_redis_city_subscribers)
+    for city_key in city_keys:
+        city_subscribers_pipeline.srem(city_key, user_id)
+    return pipeline.execute()[0]
+
+
+def city_keys(user_id):
+    return _redis_user_city.smembers(user_id)
 
 
 def all_cities(user_id):
     city_keys = _redis_user_city.smembers(user_id)
 
-    result = []
-    for city_key in city_keys:
-        data = corona.get_data(city_key)
-        if data:
-            result.append(data)
-    return result
+    return [data for data in corona.get_datas(city_keys) if data]
@@ -0,0 +1,173 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+DEFAULT_LISTEN = "127.0.0.1"
+DEFAULT_PORT = 8443
+DEFAULT_PATH = "/telegram"
+DEFAULT_QUEUE_SIZE = 100
+DEFAULT_WORKERS = 4
+_LATENCY_SAMPLES = 1000
+_MAX_BODY_SIZE = 1024 * 1024
+
+
+class _WebhookRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        webhook = self.server.webhook
+        if self.path != webhook.path:
+            self._respond(404)
+            return
+        if not webhook.is_authorized(self.headers.get(SECRET_TOKEN_HEADER)):
+            logger.warning("Rejected update from {}: invalid secret token.".format(self.client_address[0]))
+            self._respond(403)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self._respond(400)
+            return
+        if length <= 0 or length > _MAX_BODY_SIZE:
+            self._respond(400)
+            return
+        try:
+            data = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._respond(400)
+            return
+
+        # Telegram delivers the update again later if it isn't accepted now
+        self._respond(200 if webhook.enqueue(data) else 503)
+
+    def do_GET(self):
+        webhook = self.server.webhook
+        if self.path != webhook.path + "/stats":
+            self._respond(404)
+            return
+        # The path is public, the stats are only for whoever knows the secret token
+        if not webhook.is_authorized(self.headers.get(SECRET_TOKEN_HEADER)):
+            self._respond(403)
+            return
+        self._respond(200, json.dumps(webhook.stats()).encode("utf-8"), "application/json")
+
+    def _respond(self, status, body=b"", content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.client_address[0], format % args)
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # Telegram opens up to max_connections (default 40) connections at once, the default backlog is 5
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class WebhookServer():
+    """Receives updates from Telegram via HTTP POST and hands them to the dispatcher.
+
+    Updates are buffered in a bounded queue and processed by a pool of workers. If the queue is full, the request is
+    answered with 503 and Telegram retries it later. Queue depth and handling latency are available with stats() and
+    as JSON at GET <path>/stats, which requires the secret token header as well.
+    """
+
+    def __init__(self, bot, dispatcher, listen=DEFAULT_LISTEN, port=DEFAULT_PORT, path=DEFAULT_PATH,
+                 secret_token=None, queue_size=DEFAULT_QUEUE_SIZE, workers=DEFAULT_WORKERS):
+        if not secret_token:
+            # Otherwise anyone who finds the URL could send updates in the name of any user
+            raise ValueError("A secret token is required.")
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+
+        self.received = 0
+        self.rejected = 0
+        self.handled = 0
+        self.latencies = deque(maxlen=_LATENCY_SAMPLES)
+
+        self._counter_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._httpd = _HTTPServer((listen, port), _WebhookRequestHandler)
+        self._httpd.webhook = self
+        self._threads = []
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def is_authorized(self, secret_token):
+        # Compared as bytes, compare_digest rejects str with non-ASCII characters
+        return secret_token is not None and hmac.compare_digest(secret_token.encode("utf-8"),
+                                                                self.secret_token.encode("utf-8"))
+
+    def enqueue(self, data):
+        try:
+            self._queue.put_nowait((time.monotonic(), data))
+        except queue.Full:
+            with self._counter_lock:
+                self.rejected += 1
+            return False
+        with self._counter_lock:
+            self.received += 1
+        return True
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._work, name="webhook-worker-{}".format(i), daemon=True)
+                         for i in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._httpd.serve_forever, name="webhook-server", daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info("Listening for updates on {}:{}{}".format(self._httpd.server_address[0], self.port, self.path))
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        for _ in range(self.workers):
+            self._queue.put(None)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            received, data = item
+            try:
+                self.dispatcher.process_update(Update.de_json(data, self.bot))
+            except Exception:
+                logger.exception("Handling update failed: {}".format(data.get("update_id")))
+            finally:
+                with self._counter_lock:
+                    self.handled += 1
+                    self.latencies.append(time.monotonic() - received)
+
+    def stats(self):
+        with self._counter_lock:
+            latencies = list(self.latencies)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "received": self.received,
+            "rejected": self.rejected,
+            "handled": self.handled,
+            **metrics.latency_percentiles(latencies),
+        }